@@ -0,0 +1,66 @@
+# Стресс-тест покупки: сотни покупателей одновременно покупают один продукт,
+# успешной должна быть ровно одна покупка.
+#   python -m bench.seed --users 500 --products 1000 --reset
+#   python -m bench.buy_race --buyers 300
+import argparse
+import asyncio
+import collections
+import time
+
+import httpx
+from sqlalchemy import select
+
+from src.auth.base_config import get_jwt_strategy
+from src.auth.models import User
+from src.core import Core
+from src.database import async_session_factory
+from src.main import app
+from src.products.database import Product
+
+
+async def race(buyers: int) -> collections.Counter:
+    async with async_session_factory() as session:
+        users = (await session.execute(select(User).order_by(User.id).limit(buyers + 1))).scalars().all()
+    if len(users) < buyers + 1:
+        raise SystemExit(f"Need at least {buyers + 1} users, run `python -m bench.seed --users {buyers + 1}`")
+
+    seller, buyers = users[0], users[1:]
+    product = await Core.add_product({
+        "name": "race", "price": 1, "description": "race", "tags": "race", "main_img": "", "rating_elo": 0,
+        "rating_name": "", "id_user": seller.id, "username": "u", "email": "e", "password": "p",
+    })
+
+    strategy = get_jwt_strategy()
+    tokens = [await strategy.write_token(user) for user in buyers]
+    statuses = collections.Counter()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def buy(token: str):
+                response = await client.get(f"/products/buy/item/{product.id}", cookies={"bonds": token})
+                statuses[response.status_code] += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*[buy(token) for token in tokens])
+            print(f"{len(tokens)} buyers in {time.perf_counter() - start:.3f}s")
+
+    async with async_session_factory() as session:
+        # Покупка ставит tombstone: строка остается до purge_deleted, но из выдачи пропадает
+        deleted_at = await session.scalar(select(Product.deleted_at).where(Product.id == product.id))
+        live = await session.scalar(select(Product.id).where(Product.id == product.id, Core.live()))
+        assert deleted_at is not None and live is None, "product survived the purchase"
+    return statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Many buyers racing for one product")
+    parser.add_argument("--buyers", type=int, default=300)
+    args = parser.parse_args()
+
+    statuses = asyncio.run(race(args.buyers))
+    print(dict(statuses))
+    assert statuses[200] == 1, f"expected exactly one successful purchase, got {statuses[200]}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Нагрузочный тест чата против запущенного сервера (один воркер):
+#   uvicorn src.main:app --workers 1 --ws-max-queue 32
+#   ulimit -n 65536 && python -m bench.chat_load --url ws://localhost:8000 --idle 10000 --active 1000
+# Idle-клиенты только держат соединение и читают; active-клиенты раз в --interval секунд
+# отправляют сообщение с меткой времени, по ней считается задержка доставки.
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import websockets
+from sqlalchemy import select
+
+from bench.run import percentile
+from src.auth.base_config import get_jwt_strategy
+from src.auth.models import User
+from src.database import async_session_factory
+
+
+async def open_client(url: str, room: int, token: str, latencies: list, received: list):
+    websocket = await websockets.connect(f"{url}/chat/{room}/ws", additional_headers={"Cookie": f"bonds={token}"},
+                                         open_timeout=60)
+
+    async def reader():
+        async for raw in websocket:
+            received[0] += 1
+            text = json.loads(raw)["text"]
+            if text.startswith("t="):
+                latencies.append(time.time() - float(text[2:]))
+
+    return websocket, asyncio.create_task(reader())
+
+
+async def load(url: str, idle: int, active: int, rooms: int, duration: float, interval: float) -> dict:
+    async with async_session_factory() as session:
+        users = (await session.execute(select(User).limit(100))).scalars().all()
+    if not users:
+        raise SystemExit("No users, run `python -m bench.seed` first")
+    strategy = get_jwt_strategy()
+    tokens = [await strategy.write_token(user) for user in users]
+
+    latencies, received, clients = [], [0], []
+    start = time.perf_counter()
+    for n in range(idle + active):
+        clients.append(await open_client(url, n % rooms, tokens[n % len(tokens)], latencies, received))
+    connect_time = time.perf_counter() - start
+    print(f"{len(clients)} connections opened in {connect_time:.1f}s")
+
+    sent = [0]
+
+    async def talk(websocket):
+        await asyncio.sleep(random.random() * interval)
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            await websocket.send(json.dumps({"text": f"t={time.time()}"}))
+            sent[0] += 1
+            await asyncio.sleep(interval)
+
+    await asyncio.gather(*[talk(websocket) for websocket, _ in clients[idle:]])
+    await asyncio.sleep(2)
+
+    for websocket, reader in clients:
+        reader.cancel()
+        await websocket.close()
+
+    ms = [latency * 1000 for latency in latencies] or [0.0]
+    return {
+        "connections": len(clients), "idle": idle, "active": active, "rooms": rooms,
+        "connect_seconds": round(connect_time, 2), "sent": sent[0], "delivered": received[0],
+        "p50_ms": round(percentile(ms, 0.50), 2), "p95_ms": round(percentile(ms, 0.95), 2),
+        "p99_ms": round(percentile(ms, 0.99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat WebSocket load test")
+    parser.add_argument("--url", default="ws://localhost:8000")
+    parser.add_argument("--idle", type=int, default=10000)
+    parser.add_argument("--active", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between messages per active client")
+    parser.add_argument("--output", default="bench_results_chat.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(load(args.url, args.idle, args.active, args.rooms, args.duration, args.interval))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Нагрузочный прогон приложения in-process (httpx + ASGITransport) против локального Postgres.
+#   python -m bench.seed --products 100000 --reset
+#   python -m bench.run --requests 500 --concurrency 20 --output bench_results.json --baseline old.json
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+from sqlalchemy import func, select
+
+from bench.seed import BENCH_PASSWORD, GAMES, PLATFORMS, zipf_choice
+from src.core import Core
+from src.database import async_session_factory
+from src.main import app
+from src.products.database import Product
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Scenario:
+    def __init__(self, name: str, make_request):
+        self.name = name
+        self.make_request = make_request
+        self.latencies = []
+        self.errors = 0
+
+    def report(self, elapsed: float) -> dict:
+        ms = [latency * 1000 for latency in self.latencies] or [0.0]
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "throughput_rps": round(len(self.latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(ms, 0.50), 3),
+            "p95_ms": round(percentile(ms, 0.95), 3),
+            "p99_ms": round(percentile(ms, 0.99), 3),
+        }
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int) -> dict:
+    queue = asyncio.Queue()
+    for n in range(requests):
+        queue.put_nowait(n)
+
+    async def worker():
+        while not queue.empty():
+            n = queue.get_nowait()
+            method, url, kwargs = scenario.make_request(n)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            scenario.latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                scenario.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return scenario.report(time.perf_counter() - start)
+
+
+def product_params(rnd: random.Random, n: int) -> dict:
+    return {
+        "name": f"bench product {n}", "price": rnd.randint(100, 10000), "description": "bench",
+        "tags": f"{zipf_choice(rnd, GAMES)} {zipf_choice(rnd, PLATFORMS)}", "main_img": "static/products/img1.jpg",
+        "rating_elo": rnd.randint(500, 3000), "rating_name": "elo", "username": "u", "email": "e", "password": "p",
+    }
+
+
+async def bench(requests: int, concurrency: int, seed: int) -> dict:
+    rnd = random.Random(seed)
+    async with async_session_factory() as session:
+        min_id, max_id = (await session.execute(select(func.min(Product.id), func.max(Product.id)))).one()
+    if min_id is None:
+        raise SystemExit("Catalog is empty, run `python -m bench.seed` first")
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            login = await client.post("/auth/jwt/login", data={"username": "bench0@bench.local",
+                                                                "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            me = (await client.get("/users/me")).json()["user_id"]
+
+            def tags_request(method):
+                def make(n):
+                    tags = "&".join({zipf_choice(rnd, GAMES), zipf_choice(rnd, PLATFORMS)})
+                    return "GET", f"/products/{tags}/sorted/{method}", {"params": {"limit": 30}}
+                return make
+
+            scenarios = [Scenario(f"tags_{method}", tags_request(method)) for method in Core.method_functions]
+            scenarios.append(Scenario("item", lambda n: ("GET", f"/products/item/{rnd.randint(min_id, max_id)}", {})))
+            scenarios.append(Scenario("add", lambda n: ("POST", "/products/add/item",
+                                                        {"params": product_params(rnd, n)})))
+            for scenario in scenarios:
+                results[scenario.name] = await run_scenario(client, scenario, requests, concurrency)
+
+            async with async_session_factory() as session:
+                own = (await session.execute(select(Product.id).where(Product.id_user == me))).scalars().all()
+                others = (await session.execute(
+                    select(Product.id).where(Product.id_user != me).order_by(Product.id.desc()).limit(requests)
+                )).scalars().all()
+
+            rework = Scenario("rework", lambda n: ("PUT", f"/products/rework/item/{own[n % len(own)]}",
+                                                   {"params": product_params(rnd, n)}))
+            results["rework"] = await run_scenario(client, rework, requests, concurrency)
+            buy = Scenario("buy", lambda n: ("GET", f"/products/buy/item/{others[n % len(others)]}", {}))
+            results["buy"] = await run_scenario(client, buy, min(requests, len(others)), concurrency)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the in-process API benchmark")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous results JSON to compare p95 against")
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args.requests, args.concurrency, args.seed))
+    report = {"requests": args.requests, "concurrency": args.concurrency, "seed": args.seed, "scenarios": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+    for name, stats in results.items():
+        line = f"{name:<18} p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms p99={stats['p99_ms']:>8}ms " \
+               f"rps={stats['throughput_rps']:>8} errors={stats['errors']}"
+        if name in baseline and baseline[name]["p95_ms"]:
+            line += f" p95 vs baseline: {stats['p95_ms'] / baseline[name]['p95_ms']:.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
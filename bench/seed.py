@@ -0,0 +1,108 @@
+# Детерминированный генератор каталога для бенчмарков.
+#   python -m bench.seed --users 1000 --products 1000000 --reset
+import argparse
+import asyncio
+import os
+import random
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import insert, select
+
+from src.auth.models import User
+from src.core import Core
+from src.database import async_engine
+from src.products.database import Product, Image
+
+BENCH_PASSWORD = "bench-password"
+
+GAMES = ["cs2", "dota2", "valorant", "fortnite", "pubg", "apex", "lol", "wow", "minecraft", "gta5",
+         "rust", "warzone", "overwatch", "genshin", "hearthstone", "tarkov", "rocketleague", "fifa",
+         "brawlstars", "clashroyale", "roblox", "destiny2", "diablo4", "pathofexile", "lostark"]
+PLATFORMS = ["steam", "epic", "battlenet", "psn", "xbox", "riot", "mobile"]
+REGIONS = ["eu", "na", "asia", "cis", "sa"]
+FEATURES = ["prime", "rare", "skins", "ranked", "smurf", "fullaccess", "mail", "knife", "battlepass"]
+# Фиксированный список: в static/products появляются каталог variants/ и загруженные файлы,
+# а каталог должен получаться одинаковым при одном и том же --seed
+IMAGES = [name for name in ["img1.jpg", "img2.gif", "img3.jpg", "img4.jpg", "img5.jpg", "img6.jpg", "img7.gif",
+                            "img8.jpg", "img9.gif", "img10.jpg", "main_img1.jpg", "main_img2.jpg"]
+          if os.path.isfile(os.path.join("static/products", name))]
+
+
+def zipf_choice(rnd: random.Random, items: list, s: float = 1.1):
+    # Популярные теги встречаются на порядки чаще хвоста, как в реальном каталоге
+    weights = [1 / (rank ** s) for rank in range(1, len(items) + 1)]
+    return rnd.choices(items, weights=weights)[0]
+
+
+def product_tags(rnd: random.Random) -> str:
+    tags = {zipf_choice(rnd, GAMES), zipf_choice(rnd, PLATFORMS), rnd.choice(REGIONS)}
+    tags.update(zipf_choice(rnd, FEATURES) for _ in range(rnd.randint(0, 3)))
+    return " ".join(sorted(tags))
+
+
+def product_row(rnd: random.Random, n: int, id_user: int) -> dict:
+    tags = product_tags(rnd)
+    rating = int(rnd.lognormvariate(7, 0.5))
+    return {
+        "name": f"{tags.split()[0]} account #{n}",
+        "price": int(rnd.lognormvariate(7, 1)),
+        "description": " ".join(rnd.choice(FEATURES + GAMES) for _ in range(rnd.randint(20, 80))),
+        "tags": tags,
+        "tag_list": tags.split(),
+        "main_img": f"static/products/{rnd.choice(IMAGES)}",
+        "game_rating": {"rating": rating, "description": f"elo {rating}"},
+        "rating": rating,
+        "id_user": id_user,
+        "output_data": {"username": f"login{n}", "email": f"acc{n}@mail.local", "password": f"pass{n}"},
+    }
+
+
+async def seed(users: int, products: int, seed_value: int, batch: int = 5000):
+    rnd = random.Random(seed_value)
+    hashed = PasswordHelper().hash(BENCH_PASSWORD)
+
+    async with async_engine.begin() as conn:
+        result = await conn.execute(insert(User.__table__).returning(User.__table__.c.id), [{
+            "username": f"bench{i}",
+            "phone_number": f"+7900{i:07d}",
+            "email": f"bench{i}@bench.local",
+            "city": rnd.choice(["Moscow", "Kazan", "Perm", "Omsk"]),
+            "hashed_password": hashed,
+            "is_active": True,
+            "is_superuser": False,
+            "is_verified": True,
+        } for i in range(users)])
+        user_ids = [row[0] for row in result]
+
+    for start in range(0, products, batch):
+        rows = [product_row(rnd, n, rnd.choice(user_ids)) for n in range(start, min(start + batch, products))]
+        async with async_engine.begin() as conn:
+            result = await conn.execute(insert(Product.__table__).returning(Product.__table__.c.id), rows)
+            images = [{
+                "path": f"static/products/{rnd.choice(IMAGES)}",
+                "description": "screenshot",
+                "product_id": product_id,
+            } for (product_id,) in result for _ in range(rnd.randint(0, 3))]
+            if images:
+                await conn.execute(insert(Image.__table__), images)
+        print(f"products: {min(start + batch, products)}/{products}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a deterministic benchmark catalog")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    args = parser.parse_args()
+
+    async def run():
+        if args.reset:
+            await Core.create_tables()
+        await seed(args.users, args.products, args.seed)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
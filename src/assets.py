@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import os
+import time
+
+ASSET_ROOT = "static"
+ASSET_PREFIX = "/assets/"
+MANIFEST_TTL = 60  # через столько секунд запись манифеста перепроверяется в фоне
+MISSING_LIMIT = 10000  # столько путей без файла помним, чтобы не проверять их на каждом запросе
+
+_manifest = {}  # "static/products/img1.jpg" -> ("/assets/products/img1.<hash>.jpg", время проверки)
+_missing = {}  # путь без файла внутри ASSET_ROOT -> время проверки; старые вытесняются после MISSING_LIMIT
+_digests = {}  # реальный путь -> (mtime_ns, size, hash)
+_pending = set()  # пути, которые уже хэшируются в фоне
+
+
+def normalize(path: str) -> str:
+    return path.lstrip("/").replace(os.sep, "/")
+
+
+def resolve(path: str):
+    # Реальный путь файла внутри ASSET_ROOT; None — файла нет или путь выходит за корень (.., симлинки)
+    root = os.path.realpath(ASSET_ROOT)
+    real = os.path.realpath(normalize(path))
+    if not real.startswith(root + os.sep) or not os.path.isfile(real):
+        return None
+    return real
+
+
+def file_digest(path: str) -> str:
+    # Хэш кэшируется по (mtime, size): повторные запросы не перечитывают файл
+    stat = os.stat(path)
+    cached = _digests.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    _digests[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest()[:16])
+    return _digests[path][2]
+
+
+def register_asset(path: str):
+    # Имя файла с хэшем содержимого: URL меняется вместе с файлом, поэтому его можно кэшировать навсегда
+    key = normalize(path)
+    real = resolve(key)
+    _pending.discard(key)
+    if real is None:
+        # В манифест попадают только существующие файлы: произвольные пути из БД его не раздувают
+        _manifest.pop(key, None)
+        _missing.pop(key, None)
+        _missing[key] = time.monotonic()
+        while len(_missing) > MISSING_LIMIT:
+            del _missing[next(iter(_missing))]
+        return None
+    root, ext = os.path.splitext(os.path.relpath(real, os.path.realpath(ASSET_ROOT)).replace(os.sep, "/"))
+    url = f"{ASSET_PREFIX}{root}.{file_digest(real)}{ext}"
+    _missing.pop(key, None)
+    _manifest[key] = (url, time.monotonic())
+    return url
+
+
+def build_manifest():
+    for directory, _, names in os.walk(ASSET_ROOT):
+        for name in names:
+            register_asset(os.path.join(directory, name))
+
+
+def asset_url(path: str):
+    # Путь из Image.path / main_img / вариантов -> hashed URL; неизвестные пути возвращаются как есть.
+    # Только словарь в памяти: новые и устаревшие записи хэшируются в потоке, не в event loop.
+    if not path:
+        return path
+    key = normalize(path)
+    if not key.startswith(ASSET_ROOT + "/"):
+        return path  # внешние URL и пути вне static/ не проверяются
+    url, checked = _manifest.get(key, (None, _missing.get(key)))
+    if checked is None or time.monotonic() - checked > MANIFEST_TTL:
+        schedule_register(key)
+    return url or path
+
+
+def schedule_register(key: str):
+    if key in _pending:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        register_asset(key)  # вне event loop (скрипты) — сразу
+        return
+    _pending.add(key)
+    future = loop.run_in_executor(None, register_asset, key)
+    future.add_done_callback(lambda f: _pending.discard(key) if f.exception() is not None else None)
+
+
+def asset_variants(variants: list) -> list:
+    return [{**variant, "url": asset_url(variant["url"])} for variant in variants or []]
+
+
+def lookup_asset(name: str):
+    # "products/img1.<hash>.jpg" -> (реальный путь, hash). Реестр не нужен: имя разбирается, файл
+    # перехэшируется (с кэшем по mtime) и отдается, только если содержимое все еще совпадает с hash,
+    # поэтому URL работает на любом воркере, а измененный файл под старым URL не отдается.
+    parts = name.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        return None
+    stem, ext = os.path.splitext(parts[-1])
+    if len(ext) == 17 and "." not in stem:
+        stem, ext = f"{stem}{ext}", ""  # файл без расширения: "<name>.<hash>"
+    stem, _, digest = stem.rpartition(".")
+    if not stem or len(digest) != 16:
+        return None
+    real = resolve(os.path.join(ASSET_ROOT, *parts[:-1], stem + ext))
+    if real is None or file_digest(real) != digest:
+        return None
+    return real, digest
+
+
+def manifest() -> dict:
+    return {path: url for path, (url, _) in _manifest.items()}
@@ -1,17 +1,49 @@
-from fastapi_users import FastAPIUsers
+from typing import Optional
+
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi_users import FastAPIUsers, exceptions
 from fastapi_users.authentication import CookieTransport, AuthenticationBackend
 from fastapi_users.authentication import JWTStrategy
+from fastapi_users.jwt import decode_jwt
 
 from src.auth.manager import get_user_manager
 from src.auth.models import User
+from src.cache import user_cache
 
 from src.config import settings
 
 cookie_transport = CookieTransport(cookie_name="bonds", cookie_max_age=3600)
 
 
+class CachedJWTStrategy(JWTStrategy):
+    # Пользователь по subject токена берется из user_cache, БД — только при промахе.
+    # Кэш сбрасывается в UserManager.on_after_update / on_after_delete.
+    async def read_token(self, token, user_manager):
+        if token is None:
+            return None
+
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+        except jwt.PyJWTError:
+            return None
+        user_id = data.get("sub")
+        if user_id is None:
+            return None
+
+        user = await user_cache.get(user_id)
+        if user is not None:
+            return user
+        try:
+            user = await user_manager.get(user_manager.parse_id(user_id))
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        await user_cache.set(user_id, user)
+        return user
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=settings.SECRET_AUTH, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=settings.SECRET_AUTH, lifetime_seconds=3600)
 
 auth_backend = AuthenticationBackend(
     name="jwt",
@@ -24,4 +56,22 @@ fastapi_users = FastAPIUsers[User, int](
     [auth_backend],
 )
 
-current_user = fastapi_users.current_user()
\ No newline at end of file
+current_user = fastapi_users.current_user()
+
+
+def user_id_from_token(token: Optional[str]) -> Optional[int]:
+    strategy = get_jwt_strategy()
+    try:
+        data = decode_jwt(token, strategy.decode_key, strategy.token_audience, algorithms=[strategy.algorithm])
+        return int(data["sub"])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def current_user_id(token: Optional[str] = Depends(cookie_transport.scheme)) -> int:
+    # Только claims из JWT, без обращения к БД: для роутов, которым нужен лишь user.id.
+    # Деактивация пользователя вступает в силу здесь по истечении токена.
+    user_id = user_id_from_token(token)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user_id
@@ -5,6 +5,7 @@ from fastapi_users import BaseUserManager, IntegerIDMixin
 
 from src.auth.models import User
 from src.auth.utils import get_user_db
+from src.cache import user_cache
 
 SECRET = "SECRET"
 
@@ -25,6 +26,12 @@ class UserManager(IntegerIDMixin, BaseUserManager[User, int]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    async def on_after_update(self, user: User, update_dict: dict, request: Optional[Request] = None):
+        await user_cache.delete(str(user.id))
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await user_cache.delete(str(user.id))
+
 
 async def get_user_manager(user_db=Depends(get_user_db)):
     yield UserManager(user_db)
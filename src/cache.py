@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from src.config import settings
+
+
+class MemoryCache:
+    # In-process кэш с TTL и вытеснением по LRU
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    async def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_many(self, keys: list) -> dict:
+        # Только найденные ключи
+        found = {}
+        for key in keys:
+            value = await self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    async def set_many(self, items: dict):
+        for key, value in items.items():
+            await self.set(key, value)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "size": len(self._data), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class RedisCache:
+    # Подойдет любой клиент с API redis.asyncio: get / set(ex=) / mget / pipeline / delete.
+    # Вытеснение делает сам Redis (maxmemory-policy allkeys-lru), значения хранятся в JSON.
+    def __init__(self, client, ttl: float, prefix: str):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key):
+        raw = await self.client.get(f"{self.prefix}{key}")
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    async def set(self, key, value):
+        await self.client.set(f"{self.prefix}{key}", json.dumps(value, default=str), ex=int(self.ttl))
+
+    async def get_many(self, keys: list) -> dict:
+        # Один MGET на все ключи вместо GET на каждый
+        if not keys:
+            return {}
+        raws = await self.client.mget([f"{self.prefix}{key}" for key in keys])
+        found = {key: json.loads(raw) for key, raw in zip(keys, raws) if raw is not None}
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    async def set_many(self, items: dict):
+        # SET с TTL на каждый ключ, но одним round trip через pipeline
+        if not items:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(f"{self.prefix}{key}", json.dumps(value, default=str), ex=int(self.ttl))
+            await pipe.execute()
+
+    async def delete(self, *keys):
+        if keys:
+            await self.client.delete(*[f"{self.prefix}{key}" for key in keys])
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class CatalogVersion:
+    # Счетчик версий каталога: write-методы увеличивают его, и старые ключи кэша выдачи
+    # перестают находиться (дальше их вытеснит LRU/TTL)
+    def __init__(self):
+        self.value = 0
+
+    def bump(self):
+        self.value += 1
+
+
+class SingleFlight:
+    # Одновременные одинаковые промахи ждут один общий запрос к БД
+    def __init__(self):
+        self._calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+
+def create_cache(backend: str, maxsize: int, ttl: float, prefix: str):
+    if backend == "redis":
+        from redis.asyncio import Redis
+
+        return RedisCache(Redis.from_url(settings.REDIS_URL), ttl, prefix)
+    return MemoryCache(maxsize, ttl)
+
+
+product_cache = create_cache(
+    settings.PRODUCT_CACHE_BACKEND, settings.PRODUCT_CACHE_SIZE, settings.PRODUCT_CACHE_TTL, "product:"
+)
+
+# Кэш страниц выдачи живет в процессе: ключ включает локальную версию каталога
+listing_cache = MemoryCache(settings.LISTING_CACHE_SIZE, settings.LISTING_CACHE_TTL)
+listing_flight = SingleFlight()
+catalog_version = CatalogVersion()
+
+# Пользователи по subject токена: ORM-объекты, поэтому только in-process
+user_cache = MemoryCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, ForeignKey, Index
+
+from src.database import Base
+
+
+class ChatMessage(Base):
+    __tablename__ = 'chat_message'
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Без внешнего ключа: история переписки остается после покупки/удаления продукта
+    product_id = Column(Integer, nullable=False)
+    sender_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    text = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Keyset пагинация истории: (product_id, created_at, id)
+        Index("ix_chat_message_product_created", product_id, created_at, id),
+    )
@@ -0,0 +1,83 @@
+from datetime import datetime
+from typing import Optional, List
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Response, Depends
+from pydantic import ValidationError
+from sqlalchemy import select, tuple_, exists
+
+from src.auth.base_config import cookie_transport, user_id_from_token, current_user_id
+from src.chatas.database import ChatMessage
+from src.chatas.shemas import MessageIn, MessageOut
+from src.chatas.utils import Connection, hub
+from src.core import Core
+from src.database import read_session
+from src.products.database import Product
+from src.products.utils import encode_cursor, decode_cursor
+
+router = APIRouter(
+    tags=["chat"],
+    prefix="/chat"
+)
+
+
+async def room_open(session, product_id: int) -> bool:
+    # Комната продукта открыта любому вошедшему пользователю, пока продукт не удален:
+    # одно правило и для подключения к сокету, и для чтения истории
+    return bool(await session.scalar(select(exists().where(Product.id == product_id, Core.live()))))
+
+
+@router.websocket("/{product_id}/ws")
+async def chat_ws(websocket: WebSocket, product_id: int):
+    user_id = user_id_from_token(websocket.cookies.get(cookie_transport.cookie_name))
+    if user_id is None:
+        await websocket.close(code=1008)
+        return
+    async with read_session() as session:
+        if not await room_open(session, product_id):
+            await websocket.close(code=1008)
+            return
+
+    await websocket.accept()
+    connection = Connection(websocket, user_id)
+    hub.join(product_id, connection)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                message = MessageIn.model_validate_json(data)
+            except ValidationError:
+                continue
+            await hub.post(product_id, user_id, message.text)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await hub.leave(product_id, connection)
+
+
+@router.get("/{product_id}/history")
+async def chat_history(product_id: int, response: Response, limit: int = 50, cursor: Optional[str] = None,
+                       user_id: int = Depends(current_user_id)) -> List[MessageOut]:
+    # Новые сообщения сначала; курсор — (created_at, id) последнего сообщения страницы
+    stmt = (
+        select(ChatMessage)
+        .where(ChatMessage.product_id == product_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(min(limit, 200))
+    )
+    if cursor:
+        try:
+            created_at, message_id = decode_cursor(cursor)
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        stmt = stmt.where(tuple_(ChatMessage.created_at, ChatMessage.id) < tuple_(created_at, message_id))
+
+    async with read_session() as session:
+        if not await room_open(session, product_id):
+            raise HTTPException(status_code=404, detail="Product not found")
+        messages = (await session.execute(stmt)).scalars().all()
+
+    if messages and len(messages) == min(limit, 200):
+        last = messages[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([last.created_at.isoformat(), last.id])
+    return [MessageOut.model_validate(message, from_attributes=True) for message in messages]
@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+
+
+class MessageIn(BaseModel):
+    text: str = Field(min_length=1, max_length=2000)
+
+
+class MessageOut(BaseModel):
+    product_id: int
+    sender_id: int
+    text: str
+    created_at: datetime
@@ -0,0 +1,195 @@
+import asyncio
+from datetime import datetime, timezone
+
+import orjson
+from sqlalchemy import insert
+
+from src.chatas.database import ChatMessage
+from src.config import settings
+from src.database import async_session_factory
+
+
+class Connection:
+    # У каждого клиента своя ограниченная очередь и своя задача отправки:
+    # медленный клиент не задерживает рассылку по комнате, а при переполнении очереди отключается.
+    def __init__(self, websocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=settings.CHAT_SEND_QUEUE)
+        self.sender = None
+        self.closed = False
+
+    def start(self):
+        self.sender = asyncio.create_task(self.run_sender())
+        self.sender.add_done_callback(self.sender_done)
+
+    def sender_done(self, task: asyncio.Task):
+        # Ошибка отправки (клиент ушел) забирается здесь, иначе asyncio пишет "exception was never retrieved";
+        # сокет закрывается, и цикл чтения в chat_ws выходит через leave
+        if task.cancelled() or task.exception() is None:
+            return
+        print(f"Error sending chat message to user {self.user_id}: {str(task.exception())}")
+        if not self.closed:
+            asyncio.create_task(self.close(1011))
+
+    async def run_sender(self):
+        while True:
+            payload = await self.queue.get()
+            await self.websocket.send_text(payload)
+
+    def offer(self, payload: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            self.closed = True
+            self.sender.cancel()
+            asyncio.create_task(self.close(1013))  # 1013 Try Again Later: клиент не успевает читать
+            return False
+
+    async def close(self, code: int = 1000):
+        self.closed = True
+        if self.sender is not None:
+            self.sender.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class InMemoryBroker:
+    # Один воркер: публикация сразу раздается локальным подписчикам
+    def __init__(self):
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def publish(self, room: int, payload: str):
+        self.deliver(room, payload)
+
+    async def stop(self):
+        pass
+
+
+class RedisBroker:
+    # Несколько воркеров: сообщения идут через Redis pub/sub, каждый воркер раздает своим клиентам
+    def __init__(self, client):
+        self.client = client
+        self.listener = None
+
+    async def start(self, deliver):
+        pubsub = self.client.pubsub()
+        await pubsub.psubscribe("chat:*")
+
+        async def listen():
+            async for message in pubsub.listen():
+                if message["type"] == "pmessage":
+                    channel = message["channel"]
+                    channel = channel.decode() if isinstance(channel, bytes) else channel
+                    data = message["data"]
+                    deliver(int(channel.split(":", 1)[1]), data.decode() if isinstance(data, bytes) else data)
+
+        self.listener = asyncio.create_task(listen())
+
+    async def publish(self, room: int, payload: str):
+        await self.client.publish(f"chat:{room}", payload)
+
+    async def stop(self):
+        if self.listener is not None:
+            self.listener.cancel()
+
+
+class MessageWriter:
+    # Write-behind: сообщения копятся в буфере и пишутся в БД пачками одним INSERT.
+    # Пока БД недоступна, буфер растет до CHAT_BUFFER_MAX, дальше новые сообщения не сохраняются.
+    def __init__(self):
+        self.buffer = []
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def add(self, message: dict) -> bool:
+        if len(self.buffer) >= settings.CHAT_BUFFER_MAX:
+            self.dropped += 1
+            return False
+        self.buffer.append(message)
+        return True
+
+    async def flush(self):
+        while self.buffer:
+            batch = self.buffer[:settings.CHAT_FLUSH_BATCH]
+            try:
+                async with async_session_factory() as session:
+                    async with session.begin():
+                        await session.execute(insert(ChatMessage), batch)
+            except Exception as e:
+                print(f"Error writing chat messages: {str(e)}")
+                self.failed += len(batch)
+                return  # пачка остается в буфере до следующей попытки
+            del self.buffer[:len(batch)]
+            self.written += len(batch)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_FLUSH_SECONDS)
+            await self.flush()
+
+
+class ChatHub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.rooms = {}
+        self.writer = MessageWriter()
+        self.dropped = 0
+        self.flusher = None
+
+    async def start(self):
+        await self.broker.start(self.deliver)
+        self.flusher = asyncio.create_task(self.writer.run())
+
+    async def stop(self):
+        await self.broker.stop()
+        if self.flusher is not None:
+            self.flusher.cancel()
+        await self.writer.flush()
+
+    def join(self, room: int, connection: Connection):
+        connection.start()
+        self.rooms.setdefault(room, set()).add(connection)
+
+    async def leave(self, room: int, connection: Connection):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self.rooms[room]
+        await connection.close()
+
+    async def post(self, room: int, sender_id: int, text: str):
+        message = {"product_id": room, "sender_id": sender_id, "text": text,
+                   "created_at": datetime.now(timezone.utc)}
+        self.writer.add(message)
+        await self.broker.publish(room, orjson.dumps(message).decode())
+
+    def deliver(self, room: int, payload: str):
+        # payload сериализован один раз на сообщение; рассылка не ждет ни одного клиента
+        for connection in list(self.rooms.get(room, ())):
+            if not connection.offer(payload):
+                self.dropped += 1
+
+    def connections(self) -> int:
+        return sum(len(members) for members in self.rooms.values())
+
+
+def create_broker():
+    if settings.CHAT_BROKER == "redis":
+        from redis.asyncio import Redis
+
+        return RedisBroker(Redis.from_url(settings.REDIS_URL))
+    return InMemoryBroker()
+
+
+hub = ChatHub(create_broker())
@@ -8,10 +8,62 @@ class Settings(BaseSettings):
     DB_PORT: int
     DB_PASS: str
 
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = False
+    DB_AUTO_UPGRADE: bool = False  # применять SCHEMA_UPGRADES на старте; в проде — python -m src.upgrade при деплое
+    DB_POOL_PREWARM: bool = True  # открыть DB_POOL_SIZE соединений и подготовить горячие запросы на старте
+    DB_STATEMENT_CACHE_SIZE: int = 100  # кэш prepared statements asyncpg на соединение
+    DB_PGBOUNCER: bool = False  # режим совместимости с PgBouncer (transaction pooling)
+    DB_REPLICA_URLS: list[str] = []  # postgresql+asyncpg://... реплик для read-only запросов
+    DB_REPLICA_MAX_LAG_SECONDS: float = 5
+    DB_REPLICA_CHECK_SECONDS: float = 5
+
     SECRET_AUTH: str
 
     API_GRAPHHOPPER: str
 
+    PRODUCT_CACHE_BACKEND: str = "memory"  # memory | redis
+    PRODUCT_CACHE_SIZE: int = 10000
+    PRODUCT_CACHE_TTL: int = 60
+    REDIS_URL: str = "redis://localhost:6379/0"
+    LISTING_CACHE_SIZE: int = 2000
+    LISTING_CACHE_TTL: int = 10
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 30
+
+    SLOW_QUERY_SECONDS: float = 0.2
+    FACETS_REFRESH_SECONDS: int = 60
+    IMAGE_WORKERS: int = 2
+
+    RECOMMEND_TOP_K: int = 20
+    RECOMMEND_VOCAB_SIZE: int = 256  # тегов в словаре признаков, остальные не учитываются
+    RECOMMEND_REBUILD_SECONDS: int = 900
+    RECOMMEND_RELOAD_SECONDS: float = 30  # как часто воркер проверяет файл индекса
+    RECOMMEND_CANDIDATES: int = 500  # кандидатов на тег при полной сборке вместо всего каталога
+    RECOMMEND_INDEX_PATH: str = "var/recommend_index.npz"  # общий для воркеров файл собранного индекса
+
+    PURGE_INTERVAL_SECONDS: float = 60
+    PURGE_BATCH_SIZE: int = 500
+    PURGE_GRACE_SECONDS: float = 300  # сколько tombstone живет до физического удаления
+
+    JOB_WORKERS: int = 2
+    JOB_POLL_SECONDS: float = 1.0
+    JOB_MAX_ATTEMPTS: int = 8
+    JOB_BACKOFF_SECONDS: float = 2  # пауза перед повтором: 2, 4, 8, ... до JOB_BACKOFF_MAX_SECONDS
+    JOB_BACKOFF_MAX_SECONDS: float = 600
+    JOB_LEASE_SECONDS: float = 300  # взятая задача не видна другим воркерам; после падения воркера ее возьмут снова
+    JOB_RETENTION_HOURS: int = 24
+    JOB_METRICS_SECONDS: float = 10
+
+    CHAT_BROKER: str = "memory"  # memory | redis (несколько воркеров)
+    CHAT_SEND_QUEUE: int = 100  # сообщений в очереди на отправку одному клиенту
+    CHAT_FLUSH_SECONDS: float = 0.5
+    CHAT_FLUSH_BATCH: int = 500
+    CHAT_BUFFER_MAX: int = 50000  # сообщений в write-behind буфере, сверх этого не сохраняются в историю
+
     @property
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
@@ -1,31 +1,85 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, timedelta
+from functools import partial
+
+import orjson
 from fastapi import HTTPException, Depends
-from sqlalchemy import and_, asc, desc, func, Integer, cast, update
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy import and_, or_, asc, desc, func, Integer, cast, update, delete, text, tuple_, any_, case
+from sqlalchemy.dialects.postgresql import JSON, JSONB, ARRAY, array
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import insert
 
 
-from src.database import async_session_factory, async_engine, Base
-from src.products.database import Product, Image
+from src.database import async_session_factory, async_engine, read_session, replica_router, Base
+from src.products.database import (Product, Image, SchemaUpgrade, upgrade_key, SCHEMA_UPGRADES, FACETS_VIEW_STATEMENTS,
+                                   PRICE_BUCKETS, RATING_BUCKETS, product_facets)
 from src.auth.models import User
 from src.auth.base_config import current_user
-from src.products.utils import ImageCreate
+from src.products.utils import (ImageCreate, split_tags, encode_cursor, decode_cursor, product_to_dict,
+                                bucket_label, product_etag, http_date, listing_validators)
+from src.cache import product_cache, listing_cache, listing_flight, catalog_version
+from src.config import settings
+from src.products.images import process_image
+from src.products.recommend import recommender
+from src.jobs import job_queue
+from src.metrics import products_purged
+from src.assets import asset_url, asset_variants, register_asset
 
 class Core:
     @staticmethod
     async def create_tables():
         async with async_engine.begin() as conn:
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS product_facets"))
             await conn.run_sync(Base.metadata.drop_all)
             await conn.run_sync(Base.metadata.create_all)
+            for statement in FACETS_VIEW_STATEMENTS:
+                await conn.execute(text(statement))
             await conn.commit()
 
+    @staticmethod
+    async def upgrade_schema() -> int:
+        # Выполняются только еще не примененные SCHEMA_UPGRADES (ALTER TABLE берет ACCESS EXCLUSIVE
+        # даже без изменений); возвращает их число
+        async with async_engine.begin() as conn:
+            await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('upgrade_schema'))"))
+            await conn.run_sync(Base.metadata.create_all)  # только отсутствующие таблицы
+            applied = set(await conn.scalars(select(SchemaUpgrade.key)))
+            pending = [(upgrade_key(statement), statement) for statement in SCHEMA_UPGRADES
+                       if upgrade_key(statement) not in applied]
+            for key, statement in pending:
+                await conn.execute(text(statement))
+                await conn.execute(insert(SchemaUpgrade).values(key=key).on_conflict_do_nothing())
+            return len(pending)
+
+    @staticmethod
+    def hot_statements() -> list:
+        # Запросы для прогрева пула: те же тексты SQL, что и в горячих роутах, но без строк в ответе
+        statements = [select(Product).where(Product.id == 0, Core.live()), select(Image).where(Image.product_id.in_([0]))]
+        for method in Core.method_functions:
+            statements.append(Core.listing_stmt(select(Product), method, "warmup", 0, 0))
+            statements.append(Core.listing_stmt(Core.card_select(), method, "warmup", 0, 0))
+        return statements
+
+    @staticmethod
+    def live():
+        # Удаленные продукты остаются строками с deleted_at до purge_deleted и не видны ни в одном чтении
+        return Product.deleted_at.is_(None)
+
+    @staticmethod
+    def tags_condition(tags: str):
+        # AND по тегам через @> — использует частичный GIN индекс ix_product_live_tag_list
+        return Product.tag_list.contains(split_tags(tags.replace('&', ' ')))
+
     @staticmethod
     async def get_num_elem(fst_num: int, lst_num: int):
-        async with async_session_factory() as session:
+        async with read_session() as session:
             async with session.begin() as s:
-                stmt = select(Product).where(Product.id.between(fst_num, lst_num))
+                stmt = select(Product).where(Product.id.between(fst_num, lst_num), Core.live())
                 result = await session.execute(stmt)
                 items = result.scalars().all()
                 return items
@@ -33,49 +87,389 @@ class Core:
     @staticmethod
     async def get_products_by_id(p_id: int) -> list:
         async with async_session_factory() as session:
-            stmt = select(Product).where(Product.id == p_id).options(selectinload(Product.images))
+            stmt = select(Product).where(Product.id == p_id, Core.live()).options(selectinload(Product.images))
             result = await session.execute(stmt)
             item = result.scalars().all()
             return item
 
     @staticmethod
-    async def get_products_by_tags(tags: str, offset: int = 0, limit: int = 30):
-        tags_list = tags.split('&')
-        conditions = [Product.tags.op("~")(f"\\y{tag}\\y") for tag in tags_list]
+    async def get_product_card(p_id: int):
+        # Read-through кэш для /products/item/{id}; сбрасывается во всех write-методах
+        card = await product_cache.get(p_id)
+        if card is not None:
+            return card
+        items = await Core.get_products_by_id(p_id)
+        if not items:
+            return None
+        card = product_to_dict(items[0])
+        await product_cache.set(p_id, card)
+        return card
+
+    @staticmethod
+    async def get_product_validators(p_id: int):
+        # (ETag, Last-Modified) для условного GET: из кэша карточки или одним запросом по PK, без сборки карточки
+        card = await product_cache.get(p_id)
+        if card is not None and "media_version" in card:
+            return product_etag(p_id, card["version"], card["media_version"]), http_date(card["updated_at"])
         async with async_session_factory() as session:
-            stmt = select(Product).where(and_(*conditions)).offset(offset).limit(limit).options(selectinload(Product.images))
-            result = await session.execute(stmt)
-            items = result.scalars().all()
-            return items
+            row = (await session.execute(
+                select(Product.version, Product.media_version, Product.updated_at)
+                .where(Product.id == p_id, Core.live()))).one_or_none()
+        if row is None:
+            return None
+        return product_etag(p_id, row.version, row.media_version), http_date(row.updated_at)
+
+    @staticmethod
+    async def get_product_cards(ids: list) -> tuple:
+        # Сначала кэш, остальное одним запросом id = ANY(:ids) + один selectinload для картинок
+        ids = list(dict.fromkeys(ids))
+        found = await product_cache.get_many(ids)
+
+        rest = [p_id for p_id in ids if p_id not in found]
+        if rest:
+            async with async_session_factory() as session:
+                stmt = (select(Product).where(Product.id == any_(cast(rest, ARRAY(Integer))), Core.live())
+                        .options(selectinload(Product.images)))
+                result = await session.execute(stmt)
+                loaded = {item.id: product_to_dict(item) for item in result.scalars().all()}
+            await product_cache.set_many(loaded)
+            found.update(loaded)
+
+        items = [found[p_id] for p_id in ids if p_id in found]
+        missing = [p_id for p_id in ids if p_id not in found]
+        return items, missing
 
     @staticmethod
-    async def sorted_products(method: str, tags: str, offset: int = 0, limit: int = 30):
+    async def get_user_cards(id_user: int, limit: int = 30, cursor: str = None) -> tuple:
+        # Продукты владельца по индексу (id_user, id), новые сначала
+        stmt = Core.card_select().where(Product.id_user == id_user, Core.live()).order_by(Product.id.desc()).limit(limit)
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != 2 or values[0] != "user":
+                raise ValueError("Invalid cursor")
+            stmt = stmt.where(Product.id < values[1])
         async with async_session_factory() as session:
-            tags_list = tags.split('&')
-            conditions = [Product.tags.op("~")(f"\\y{tag}\\y") for tag in tags_list]
-
-            method_functions = {
-                "default": None,
-                "rating_up": asc(cast(Product.game_rating['rating'], Integer)),
-                "rating_down": desc(cast(Product.game_rating['rating'], Integer)),
-                "price_up": asc(Product.price),
-                "price_down": desc(Product.price),
-            }
+            result = await session.execute(stmt)
+            cards = Core.rows_to_cards(result)
+        next_cursor = encode_cursor(["user", cards[-1]["id"]]) if len(cards) == limit else None
+        return cards, next_cursor
+
+    @staticmethod
+    async def get_products_by_tags(tags: str, offset: int = 0, limit: int = 30, cursor: str = None):
+        return await Core.sorted_products("default", tags, offset, limit, cursor)
+
+    # Метод сортировки -> (ключ сортировки, по убыванию).
+    # id всегда добавляется вторым ключом, чтобы порядок был однозначным для курсора.
+    method_functions = {
+        "default": (None, False),
+        "rating_up": (Product.rating, False),
+        "rating_down": (Product.rating, True),
+        "price_up": (Product.price, False),
+        "price_down": (Product.price, True),
+    }
+
+    # Поля карточки для списков: без тяжелых description и output_data
+    card_columns = (Product.id, Product.name, Product.price, Product.tags, Product.main_img,
+                    Product.main_img_variants, Product.game_rating, Product.rating, Product.id_user,
+                    Product.version, Product.media_version, Product.updated_at)
 
-            order_clause = method_functions[method]
+    @staticmethod
+    def sort_columns(method: str) -> tuple:
+        key, descending = Core.method_functions[method]
+        columns = [Product.id] if key is None else [key, Product.id]
+        return columns, descending
+
+    @staticmethod
+    def seek_condition(method: str, cursor: str):
+        columns, descending = Core.sort_columns(method)
+        values = decode_cursor(cursor)
+        if len(values) != len(columns) + 1 or values[0] != method:
+            raise ValueError("Cursor does not match sort method")
+        # WHERE (sort_key, id) > (...) — продолжаем с места, где закончилась прошлая страница
+        if descending:
+            return tuple_(*columns) < tuple_(*values[1:])
+        return tuple_(*columns) > tuple_(*values[1:])
+
+    @staticmethod
+    def next_cursor(method: str, items: list, limit: int):
+        if not items or len(items) < limit:
+            return None
+        last = items[-1]
+        if not isinstance(last, dict):
+            last = {"id": last.id, "price": last.price, "rating": last.rating}
+        key, _ = Core.method_functions[method]
+        values = [method] if key is None else [method, last[key.key]]
+        return encode_cursor(values + [last["id"]])
+
+    @staticmethod
+    def listing_stmt(stmt, method: str, tags: str, offset: int, limit: int, cursor: str = None):
+        columns, descending = Core.sort_columns(method)
+        order = desc if descending else asc
+
+        stmt = stmt.where(Core.live())  # частичные индексы ... WHERE deleted_at IS NULL
+        if tags:
+            stmt = stmt.where(Core.tags_condition(tags))  # Применяем все условия фильтрации
+        stmt = (
+            stmt
+            .order_by(*[order(column) for column in columns])  # Устанавливаем порядок сортировки
+            .limit(limit)  # Ограничение на количество элементов
+        )
+        if cursor:
+            return stmt.where(Core.seek_condition(method, cursor))  # Keyset пагинация по курсору
+        return stmt.offset(offset)  # Смещение для пагинации
+
+    @staticmethod
+    def card_select():
+        # Пути картинок собираются array_agg в том же запросе, без второго selectinload
+        images = (
+            select(func.array_agg(Image.path))
+            .where(Image.product_id == Product.id)
+            .correlate(Product)
+            .scalar_subquery()
+        )
+        image_variants = (
+            select(func.jsonb_agg(func.coalesce(Image.variants, text("'[]'::jsonb"))))
+            .where(Image.product_id == Product.id)
+            .correlate(Product)
+            .scalar_subquery()
+        )
+        return select(*Core.card_columns, images.label("images"), image_variants.label("image_variants"))
 
-            stmt = (
-                select(Product)
-                .where(and_(*conditions))  # Применяем все условия фильтрации
-                .order_by(order_clause)  # Устанавливаем порядок сортировки
-                .offset(offset)  # Смещение для пагинации
-                .limit(limit)  # Ограничение на количество элементов
-                .options(selectinload(Product.images))  # Предзагрузка связанных изображений
+    @staticmethod
+    def rows_to_cards(result) -> list:
+        cards = []
+        for row in result:
+            card = dict(row._mapping)
+            card["images"] = card["images"] or []
+            card["image_urls"] = [asset_url(path) for path in card["images"]]
+            card["image_variants"] = [asset_variants(variants) for variants in card["image_variants"] or []]
+            card["main_img_url"] = asset_url(card["main_img"])
+            card["main_img_variants"] = asset_variants(card["main_img_variants"])
+            card["updated_at"] = card["updated_at"].isoformat() if card["updated_at"] else None
+            cards.append(card)
+        return cards
+
+    @staticmethod
+    async def sorted_products(method: str, tags: str, offset: int = 0, limit: int = 30, cursor: str = None):
+        async with read_session(fresh=True) as session:
+            stmt = Core.listing_stmt(
+                select(Product).options(selectinload(Product.images)),  # Предзагрузка связанных изображений
+                method, tags, offset, limit, cursor,
             )
             result = await session.execute(stmt)
             items = result.scalars().all()
             return items
 
+    @staticmethod
+    async def sorted_cards(method: str, tags: str, offset: int = 0, limit: int = 30, cursor: str = None) -> list:
+        async with read_session(fresh=True) as session:
+            stmt = Core.listing_stmt(Core.card_select(), method, tags, offset, limit, cursor)
+            result = await session.execute(stmt)
+            return Core.rows_to_cards(result)
+
+    @staticmethod
+    async def search_cards(q: str, tags: str = None, method: str = "default", offset: int = 0, limit: int = 30,
+                           cursor: str = None) -> list:
+        # Совпадение по tsvector (GIN), по триграммам или по префиксу названия (оба — индекс ix_product_name_trgm).
+        # "default" — сортировка по релевантности, остальные методы — как в выдаче по тегам.
+        query = func.websearch_to_tsquery("simple", q)
+        # NULL в любом слагаемом (name IS NULL, пустой search_vector) дал бы rank NULL, а он при DESC идет первым
+        rank = (func.coalesce(func.ts_rank_cd(Product.search_vector, query), 0)
+                + func.coalesce(func.similarity(Product.name, q), 0)).label("rank")
+        stmt = Core.card_select().add_columns(rank).where(or_(
+            Product.search_vector.op("@@")(query),
+            Product.name.op("%")(q),
+            Product.name.istartswith(q, autoescape=True),
+        ))
+        if method == "default":
+            stmt = stmt.where(Core.live())
+            if tags:
+                stmt = stmt.where(Core.tags_condition(tags))
+            stmt = stmt.order_by(rank.desc(), Product.id).offset(offset).limit(limit)
+        else:
+            stmt = Core.listing_stmt(stmt, method, tags, offset, limit, cursor)
+        async with read_session(fresh=True) as session:
+            result = await session.execute(stmt)
+            return Core.rows_to_cards(result)
+
+    @staticmethod
+    async def refresh_facets():
+        async with async_engine.begin() as conn:
+            # Один воркер из нескольких обновляет view, остальные пропускают этот цикл
+            if await conn.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('product_facets'))")):
+                await conn.execute(text("REFRESH MATERIALIZED VIEW CONCURRENTLY product_facets"))
+
+    @staticmethod
+    async def refresh_facets_periodically():
+        while True:
+            await asyncio.sleep(settings.FACETS_REFRESH_SECONDS)
+            try:
+                await Core.refresh_facets()
+            except Exception as e:
+                print(f"Error refreshing facets: {str(e)}")
+
+    @staticmethod
+    async def get_facets(tags: str = None, tag_limit: int = 50) -> dict:
+        key = ("facets", catalog_version.value, "&".join(sorted(split_tags((tags or "").replace('&', ' ')))))
+        facets = await listing_cache.get(key)
+        if facets is not None:
+            return facets
+
+        async def load():
+            async with read_session(fresh=True) as session:
+                if tags:
+                    # Под фильтр считаем по строкам, найденным через GIN индекс тегов
+                    condition = and_(Core.live(), Core.tags_condition(tags))
+                    tag = select(func.unnest(Product.tag_list).label("tag")).where(condition).subquery()
+                    tag_rows = await session.execute(
+                        select(tag.c.tag, func.count()).group_by(tag.c.tag).order_by(func.count().desc())
+                        .limit(tag_limit))
+                    buckets = {}
+                    for facet, column, bounds in (("price", Product.price, PRICE_BUCKETS),
+                                                  ("rating", Product.rating, RATING_BUCKETS)):
+                        bucket = func.width_bucket(column, array(bounds))
+                        rows = await session.execute(
+                            select(bucket, func.count()).where(condition, column.isnot(None)).group_by(text("1")))
+                        buckets[facet] = rows.all()
+                else:
+                    # Глобальные счетчики — из materialized view product_facets
+                    tag_rows = await session.execute(
+                        select(product_facets.c.bucket, product_facets.c.n).where(product_facets.c.facet == "tag")
+                        .order_by(product_facets.c.n.desc()).limit(tag_limit))
+                    rows = (await session.execute(
+                        select(product_facets.c.facet, product_facets.c.bucket, product_facets.c.n)
+                        .where(product_facets.c.facet.in_(["price", "rating"])))).all()
+                    buckets = {facet: [(int(b), n) for f, b, n in rows if f == facet] for facet in ("price", "rating")}
+
+                result = {
+                    "tags": [{"tag": tag_name, "count": n} for tag_name, n in tag_rows],
+                    "price": [{"bucket": bucket_label(PRICE_BUCKETS, b), "count": n}
+                              for b, n in sorted(buckets["price"])],
+                    "rating": [{"bucket": bucket_label(RATING_BUCKETS, b), "count": n}
+                               for b, n in sorted(buckets["rating"])],
+                }
+            await listing_cache.set(key, result)
+            return result
+
+        return await listing_flight.do(key, load)
+
+    @staticmethod
+    async def search_page(method: str, tags: str, offset: int = 0, limit: int = 30, cursor: str = None,
+                          lean: bool = False) -> dict:
+        Core.sort_columns(method)  # неизвестный метод -> KeyError до обращения к кэшу
+        key = (catalog_version.value, method, "&".join(sorted(split_tags(tags.replace('&', ' ')))),
+               offset, limit, cursor, lean)
+        page = await listing_cache.get(key)
+        if page is not None:
+            return page
+
+        async def load():
+            if lean:
+                items = await Core.sorted_cards(method, tags, offset, limit, cursor)
+            else:
+                items = await Core.sorted_products(method, tags, offset, limit, cursor)
+            result = {
+                "items": items if lean else [product_to_dict(item) for item in items],
+                "next_cursor": Core.next_cursor(method, items, limit),
+            }
+            result["etag"], result["last_modified"] = listing_validators(result["items"])
+            await listing_cache.set(key, result)
+            return result
+
+        return await listing_flight.do(key, load)
+
+    @staticmethod
+    async def catalog_changed(*p_ids: int):
+        # Вызывается после коммита в write-методах
+        replica_router.wrote()
+        catalog_version.bump()
+        await product_cache.delete(*p_ids)
+
+    @staticmethod
+    async def recommend_entries() -> list:
+        async with read_session() as session:
+            result = await session.execute(
+                select(Product.id, Product.tag_list, Product.price, Product.rating).where(Core.live()))
+            return [tuple(row) for row in result]
+
+    @staticmethod
+    async def rebuild_recommendations():
+        # Индекс собирает один воркер из всех; lock сессионный, транзакция на время сборки не держится
+        path = settings.RECOMMEND_INDEX_PATH
+        async with async_engine.connect() as conn:
+            locked = await conn.scalar(text("SELECT pg_try_advisory_lock(hashtext('recommend_index'))"))
+            await conn.commit()
+            if not locked:
+                return
+            try:
+                # Пока ждали очереди, индекс мог пересобрать другой воркер
+                if recommender.index_age(path) >= settings.RECOMMEND_REBUILD_SECONDS:
+                    await recommender.rebuild(Core.recommend_entries, path)
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(hashtext('recommend_index'))"))
+                await conn.commit()
+
+    @staticmethod
+    async def rebuild_recommendations_periodically():
+        # Свежий файл индекса подхватывается за RECOMMEND_RELOAD_SECONDS, устаревший пересобирается
+        while True:
+            try:
+                if recommender.index_age(settings.RECOMMEND_INDEX_PATH) >= settings.RECOMMEND_REBUILD_SECONDS:
+                    await Core.rebuild_recommendations()
+                await recommender.reload(settings.RECOMMEND_INDEX_PATH)
+            except Exception as e:
+                print(f"Error rebuilding recommendations: {str(e)}")
+            await asyncio.sleep(settings.RECOMMEND_RELOAD_SECONDS)
+
+    @staticmethod
+    async def similar_products(p_id: int, limit: int = 10) -> list:
+        # Соседи берутся из индекса в памяти, карточки — через кэш продуктов
+        neighbours = recommender.similar(p_id, limit)
+        cards, _ = await Core.get_product_cards([n_id for n_id, _ in neighbours])
+        cards = {card["id"]: card for card in cards}
+        return [{**cards[n_id], "similarity": round(score, 4)} for n_id, score in neighbours if n_id in cards]
+
+    export_fields = ["id", "name", "price", "description", "tags", "main_img", "game_rating", "rating",
+                     "id_user", "images", "updated_at"]
+
+    @staticmethod
+    async def export_products(fmt: str, updated_since: datetime = None, chunk_size: int = 64 * 1024):
+        # Выгрузка каталога без output_data. Строки читаются серверным курсором пачками yield_per,
+        # наружу уходят чанками ~chunk_size байт, первая строка — сразу.
+        stmt = Core.card_select().add_columns(Product.description).where(Core.live()).order_by(Product.id)
+        if updated_since is not None:
+            stmt = stmt.where(Product.updated_at >= updated_since)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(Core.export_fields)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+        first = True
+        async with read_session() as session:
+            result = await session.stream(stmt.execution_options(yield_per=1000))
+            async for row in result:
+                card = row._asdict()
+                card["images"] = card["images"] or []
+                if fmt == "csv":
+                    writer.writerow([
+                        orjson.dumps(card[field]).decode() if field in ("game_rating", "images") else card[field]
+                        for field in Core.export_fields
+                    ])
+                else:
+                    buffer.write(orjson.dumps({field: card[field] for field in Core.export_fields}).decode())
+                    buffer.write("\n")
+                if first or buffer.tell() >= chunk_size:
+                    first = False
+                    yield buffer.getvalue().encode()
+                    buffer.seek(0)
+                    buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
     @staticmethod
     async def add_product(self: dict):
         async with async_session_factory() as session:
@@ -86,17 +480,20 @@ class Core:
                     price=int(self['price']),
                     description=self['description'],
                     tags=self['tags'],
+                    tag_list=split_tags(self['tags']),
                     main_img=self['main_img'],
                     game_rating={
                         "rating": int(self['rating_elo']),
                         "description": self['rating_name']
                     },
+                    rating=int(self['rating_elo']),
                     id_user=self['id_user'],
                     output_data={
                         "username": self['username'],
                         "email": self['email'],
                         "password": self['password']
-                    }
+                    },
+                    images=[],  # у нового продукта картинок нет — повторный SELECT с joinedload не нужен
                 )
                 session.add(product)
                 await session.flush()
@@ -104,36 +501,123 @@ class Core:
                 # Получаем ID нового продукта
                 new_product_id = product.id
 
-                # Обновляем колонку user_products у пользователя
-                user_stmt = select(User).where(User.id == self['id_user'])
-                user_result = await session.execute(user_stmt)
-                user = user_result.scalars().one_or_none()
-
-                if user:
-                    if user.user_products is None:
-                        user.user_products = []
-                    user.user_products.append(new_product_id)
+                # user_products и варианты картинки обновят фоновые задачи, они коммитятся вместе с продуктом
+                await job_queue.enqueue(session, "user_products", {"id_user": self['id_user'], "add": [new_product_id]},
+                                        key=f"user_products:add:{new_product_id}")
+                await job_queue.enqueue(session, "build_variants",
+                                        {"path": self['main_img'], "product_id": new_product_id},
+                                        key=f"variants:{new_product_id}:{product.version}")
 
-                    # Обновляем пользователя в базе данных
-                    user_update_stmt = update(User).where(User.id == user.id).values(
-                        user_products=user.user_products)
-                    await session.execute(user_update_stmt)
+        job_queue.notify()
+        await Core.catalog_changed()
+        await recommender.upsert([(new_product_id, product.tag_list, product.price, product.rating)])
+        return product
 
-            await session.commit()
+    @staticmethod
+    async def bulk_add_products(rows, id_user: int, batch_size: int = 1000) -> dict:
+        inserted = 0
+        errors = []
+        batch = []
+
+        async def insert_rows(part):
+            values = [{
+                "name": row.name,
+                "price": row.price,
+                "description": row.description,
+                "tags": row.tags,
+                "tag_list": split_tags(row.tags),
+                "main_img": row.main_img,
+                "game_rating": {"rating": row.rating_elo, "description": row.rating_name},
+                "rating": row.rating_elo,
+                "id_user": id_user,
+                "output_data": {"username": row.username, "email": row.email, "password": row.password},
+            } for _, row in part]
+            async with async_session_factory() as session:
+                async with session.begin():
+                    # Многострочный INSERT ... VALUES ... RETURNING и одно обновление владельца на пачку
+                    result = await session.scalars(
+                        insert(Product).returning(Product.id, sort_by_parameter_order=True), values)
+                    ids = list(result)
+                    await job_queue.enqueue(session, "user_products", {"id_user": id_user, "add": ids},
+                                            key=f"user_products:add:{ids[0]}-{ids[-1]}")
+                    await job_queue.enqueue_many(session, "build_variants", [
+                        ({"path": value["main_img"], "product_id": p_id}, f"variants:{p_id}:1")
+                        for p_id, value in zip(ids, values)])
+            # Только то, что уже закоммичено; побочные эффекты — в flush, вне повтора по строкам
+            return [(p_id, value["tag_list"], value["price"], value["rating"]) for p_id, value in zip(ids, values)]
+
+        async def flush():
+            nonlocal inserted
+            added = []
+            try:
+                added += await insert_rows(batch)
+            except Exception as e:
+                print(f"Error during bulk import: {str(e)}")
+                if len(batch) == 1:
+                    errors.append({"row": batch[0][0], "error": str(e)})
+                else:
+                    # Пачка откатилась целиком: повторяем по одной строке, чтобы ошибка досталась только плохим
+                    for item in batch:
+                        try:
+                            added += await insert_rows([item])
+                        except Exception as row_error:
+                            errors.append({"row": item[0], "error": str(row_error)})
+            batch.clear()
+            if not added:
+                return
+            inserted += len(added)
+            job_queue.notify()
+            try:
+                await recommender.upsert(added)
+            except Exception as e:
+                print(f"Error updating recommendations after bulk import: {str(e)}")
+
+        async for row_no, row, error in rows:
+            if error is not None:
+                errors.append({"row": row_no, "error": error})
+                continue
+            batch.append((row_no, row))
+            if len(batch) >= batch_size:
+                await flush()
+        if batch:
+            await flush()
+
+        if inserted:
+            await Core.catalog_changed()
+        return {"inserted": inserted, "errors": errors}
 
-            # Явно загружаем связанные данные, такие как images
-            product_stmt = select(Product).options(joinedload(Product.images)).where(
-                Product.id == new_product_id)
-            product_result = await session.execute(product_stmt)
-            product = product_result.unique().scalars().one_or_none()
+    @staticmethod
+    async def build_variants(session: AsyncSession, payload: dict):
+        # Задача build_variants: ресайз в пуле процессов, без image_id — варианты для main_img продукта.
+        # Ошибка ресайза уходит в очередь и задача повторится позже.
+        product_id, image_id = payload["product_id"], payload.get("image_id")
+        variants = await process_image(payload["path"])
+        for variant in variants:
+            await asyncio.to_thread(register_asset, variant["url"])
+        # Варианты меняют ответ, но это не правка: растет media_version, If-Match клиента остается верным
+        values = {"media_version": Product.media_version + 1}
+        if image_id is not None:
+            await session.execute(update(Image).where(Image.id == image_id).values(variants=variants))
+        else:
+            values["main_img_variants"] = variants
+        await session.execute(update(Product).where(Product.id == product_id).values(**values))
+        return partial(Core.catalog_changed, product_id)
 
-            return product
+    @staticmethod
+    async def sync_user_products(session: AsyncSession, payload: dict):
+        # Задача user_products: id дописываются и убираются на стороне сервера, без чтения массива
+        products = User.user_products
+        if payload.get("add"):
+            products = func.array_cat(products, cast(payload["add"], ARRAY(Integer)))
+        for p_id in payload.get("remove", []):
+            products = func.array_remove(products, p_id)
+        await session.execute(update(User).where(User.id == payload["id_user"]).values(user_products=products))
 
     @staticmethod
     async def add_image(image_data: ImageCreate):
         async with async_session_factory() as session:
-            async with session.begin():
-                try:
+            try:
+                async with session.begin():
                     # Создаем новый объект Image
                     new_image = Image(
                         path=image_data.path,
@@ -141,112 +625,169 @@ class Core:
                         product_id=image_data.product_id
                     )
                     session.add(new_image)
+                    await session.execute(update(Product).where(Product.id == image_data.product_id).values(
+                        version=Product.version + 1))
                     await session.flush()
+                    await job_queue.enqueue(session, "build_variants", {
+                        "path": new_image.path, "product_id": image_data.product_id, "image_id": new_image.id,
+                    }, key=f"variants:image:{new_image.id}")
 
-                    await session.commit()
-
+            except Exception as e:
+                print(f"Error adding image: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
 
-                    return new_image
+        job_queue.notify()
+        await Core.catalog_changed(image_data.product_id)
+        return new_image
 
-                except Exception as e:
-                    print(f"Error adding image: {str(e)}")
-                    await session.rollback()
-                    raise HTTPException(status_code=500, detail=str(e))
+    @staticmethod
+    async def remove_product(session: AsyncSession, p_id: int):
+        # Tombstone в транзакции вызывающего: продукт сразу пропадает из чтений,
+        # картинки, строку и id у владельца потом убирает purge_deleted
+        await session.execute(update(Product).where(Product.id == p_id).values(
+            deleted_at=func.now(), version=Product.version + 1))
 
     @staticmethod
     async def delete_product(p_id: int):
         async with async_session_factory() as session:
-            async with session.begin():
-                try:
-                    stmt = select(Product).where(Product.id == p_id).options(joinedload(Product.id_user))
-                    result = await session.execute(stmt)
-                    product = result.scalars().one_or_none()
+            try:
+                async with session.begin():
+                    stmt = select(Product.id).where(Product.id == p_id, Core.live()).with_for_update()
+                    product = (await session.execute(stmt)).one_or_none()
 
                     if product is None:
                         print(f"Product with ID {p_id} not found.")
                         return {"message": "Product not found", "id": p_id}
 
-                    user_stmt = select(User).where(User.id == product.id_user)
-                    user_result = await session.execute(user_stmt)
-                    user = user_result.scalars().one_or_none()
-
-                    if user is None:
-                        print(f"User with ID {product.id_user} not found.")
-                        return {"message": "User not found", "id_user": product.id_user}
-
-                    if user.output_data:
-                        output_data = user.output_data
-                        updated_output_data = [item for item in output_data if item.get("id") != p_id]
+                    await Core.remove_product(session, p_id)
 
-                        # Обновить пользователя в базе данных
-                        user_update_stmt = update(User).where(User.id == user.id).values(
-                            output_data=updated_output_data)
-                        await session.execute(user_update_stmt)
+            except Exception as e:
+                print(f"Error during deletion: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
 
-                    await session.delete(product)
-                    print(f"Product with ID {p_id} scheduled for deletion.")
-                    await session.commit()
-
-                    return {"message": "Product deleted", "id": p_id}
-
-                except Exception as e:
-                    print(f"Error during deletion: {str(e)}")
-                    await session.rollback()
-                    raise HTTPException(status_code=500, detail=str(e))
+            await Core.catalog_changed(p_id)
+            await recommender.remove([p_id])
+            return {"message": "Product deleted", "id": p_id}
 
     @staticmethod
-    async def rework_product(p_id: int, kwargs: dict, cur_user: int):
+    async def purge_deleted(batch_size: int) -> int:
+        # Одна пачка: SKIP LOCKED, чтобы несколько воркеров не ждали друг друга
         async with async_session_factory() as session:
             async with session.begin():
-                try:
-                    stmt = select(Product).where(Product.id == p_id).options(joinedload(Product.images))
-                    result = await session.execute(stmt)
-                    item = result.unique().scalars().one_or_none()  # Используем unique() для исключения дублирующих результатов
-                    if item is None:
-                        print(f"Product with ID {p_id} not found.")
-                        return {"message": "Product not found", "id": p_id}
-                    if item.id_user != cur_user:
-                        raise HTTPException(status_code=400, detail=f"Вы не владелец этого продукта {cur_user}")
-
-                    # Обновление полей продукта
-                    for key, value in kwargs.items():
-                        setattr(item, key, value)
+                stmt = (select(Product.id, Product.id_user)
+                        .where(Product.deleted_at < func.now() - timedelta(seconds=settings.PURGE_GRACE_SECONDS))
+                        .order_by(Product.deleted_at).limit(batch_size).with_for_update(skip_locked=True))
+                rows = (await session.execute(stmt)).all()
+                if not rows:
+                    return 0
+                ids = [row.id for row in rows]
+                owners = list({row.id_user for row in rows if row.id_user is not None})
+                await session.execute(delete(Image).where(Image.product_id == any_(cast(ids, ARRAY(Integer)))))
+                await session.execute(text(
+                    'UPDATE "user" SET user_products = ARRAY(SELECT x FROM unnest(user_products) AS x WHERE x <> ALL(:ids)) '
+                    'WHERE id = ANY(:owners)'
+                ), {"ids": ids, "owners": owners})
+                await session.execute(delete(Product).where(Product.id == any_(cast(ids, ARRAY(Integer)))))
+        products_purged.inc(len(ids))
+        return len(ids)
 
-                    # Обновление output_data в продукте
-                    item.output_data = {
-                        "username": kwargs.get("username", item.output_data.get("username")),
-                        "email": kwargs.get("email", item.output_data.get("email")),
-                        "password": kwargs.get("password", item.output_data.get("password"))
-                    }
-
-                    await session.commit()
-#                    await session.refresh(item)  # Обновляем продукт после коммита
+    @staticmethod
+    async def purge_deleted_periodically():
+        while True:
+            try:
+                # Полная пачка — сразу следующая, иначе ждем PURGE_INTERVAL_SECONDS
+                while await Core.purge_deleted(settings.PURGE_BATCH_SIZE) == settings.PURGE_BATCH_SIZE:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                print(f"Error purging deleted products: {str(e)}")
+            await asyncio.sleep(settings.PURGE_INTERVAL_SECONDS)
 
-                    return item
+    @staticmethod
+    async def rework_product(p_id: int, kwargs: dict, cur_user: int, version: int = None):
+        # Один UPDATE ... RETURNING вместо SELECT + flush. С version (If-Match) строка обновится,
+        # только если ее никто не изменил после того, как клиент ее прочитал.
+        values = {key: kwargs[key] for key in ("name", "price", "description", "tags", "main_img", "game_rating")
+                  if key in kwargs}
+        if "tags" in kwargs:
+            values["tag_list"] = split_tags(kwargs["tags"])
+        if "game_rating" in kwargs:
+            values["rating"] = int(kwargs["game_rating"]["rating"])
+        if "main_img" in kwargs:
+            # В SET справа старые значения: при смене картинки варианты сбрасываются и строятся заново
+            values["main_img_variants"] = case(
+                (Product.main_img == kwargs["main_img"], Product.main_img_variants), else_=None)
+        output_data = {key: kwargs[key] for key in ("username", "email", "password") if key in kwargs}
+        if output_data:
+            values["output_data"] = func.coalesce(Product.output_data, text("'{}'::jsonb")).op("||")(
+                cast(output_data, JSONB))
+        values["version"] = Product.version + 1
+
+        conditions = [Product.id == p_id, Product.id_user == cur_user, Core.live()]
+        if version is not None:
+            conditions.append(Product.version == version)
 
-                except Exception as e:
-                    print(f"Error during rework: {str(e)}")
-                    await session.rollback()
-                    raise HTTPException(status_code=500, detail=str(e))
+        async with async_session_factory() as session:
+            try:
+                async with session.begin():
+                    stmt = (update(Product).where(*conditions).values(**values).returning(Product)
+                            .execution_options(synchronize_session=False))
+                    item = (await session.execute(stmt)).scalars().one_or_none()
+                    if item is None:
+                        stmt = select(Product.id_user).where(Product.id == p_id, Core.live())
+                        owner = await session.scalar(stmt)
+                        if owner is None:
+                            print(f"Product with ID {p_id} not found.")
+                            return {"message": "Product not found", "id": p_id}
+                        if owner != cur_user:
+                            raise HTTPException(status_code=400, detail=f"Вы не владелец этого продукта {cur_user}")
+                        raise HTTPException(status_code=412, detail="Product was modified, reload it and retry")
+                    await session.refresh(item, ["images"])
+                    if item.main_img_variants is None:
+                        await job_queue.enqueue(session, "build_variants", {"path": item.main_img, "product_id": p_id},
+                                                key=f"variants:{p_id}:{item.version}")
+
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"Error during rework: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+        job_queue.notify()
+        await Core.catalog_changed(p_id)
+        await recommender.upsert([(p_id, item.tag_list, item.price, item.rating)])
+        return item
 
     @staticmethod
     async def buy_item(p_id: int, cur_user: int):
+        # Одна транзакция: FOR UPDATE SKIP LOCKED пропускает строку, которую уже покупает другой
+        # запрос, поэтому побеждает ровно один покупатель, а остальные сразу получают 409.
         async with async_session_factory() as session:
-            async with session.begin():
-                try:
-                    stmt = select(Product).where(Product.id == p_id)
-                    result = await session.execute(stmt)
-                    item = result.scalars().one_or_none()
+            try:
+                async with session.begin():
+                    stmt = (select(Product.id_user).where(Product.id == p_id, Core.live())
+                            .with_for_update(skip_locked=True))
+                    item = (await session.execute(stmt)).one_or_none()
                     if item is None:
-                        print(f"Product with ID {p_id} not found.")
-                        return {"message": "Product not found", "id": p_id}
+                        exists = await session.scalar(select(Product.id).where(Product.id == p_id, Core.live()))
+                        if exists is None:
+                            raise HTTPException(status_code=404, detail="Product not found")
+                        raise HTTPException(status_code=409, detail="Product is already being bought")
                     if item.id_user == cur_user:
-                        raise HTTPException(status_code=400, detail=f"Вы не можете купить свой продукт {current_user}")
-                    await Core.delete_product(p_id)
-                    await session.commit()
-                    return {"message": "Product bought", "id": p_id}
-
-                except Exception as e:
-                    print(f"Error during buying: {str(e)}")
-                    await session.rollback()
-                    raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+                        raise HTTPException(status_code=400, detail=f"Вы не можете купить свой продукт {cur_user}")
+                    await Core.remove_product(session, p_id)
+
+            except HTTPException:
+                raise
+            except Exception as e:
+                print(f"Error during buying: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+            await Core.catalog_changed(p_id)
+            await recommender.remove([p_id])
+            return {"message": "Product bought", "id": p_id}
+
+
+job_queue.handlers.update({
+    "build_variants": Core.build_variants,
+    "user_products": Core.sync_user_products,
+})
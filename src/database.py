@@ -1,22 +1,143 @@
+import asyncio
+import time
 from typing import AsyncGenerator
-from sqlalchemy import Column, Integer, String
+from uuid import uuid4
+from sqlalchemy import Column, Integer, String, text, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
 from src.config import settings
+from src.metrics import pool_wait
 
-async_engine = create_async_engine(
-    url=settings.DATABASE_URL_asyncpg,
-)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Замеряем ожидание свободного соединения — признак исчерпания пула
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - start)
+
+
+def engine_options(url: str) -> dict:
+    connect_args = {}
+    cache_size = settings.DB_STATEMENT_CACHE_SIZE
+    if settings.DB_PGBOUNCER:
+        # В transaction-режиме PgBouncer соединение с сервером меняется между транзакциями,
+        # поэтому кэш prepared statements выключен, а их имена уникальны
+        cache_size = 0
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return dict(
+        # URL реплик может уже содержать параметры (?ssl=require): добавляем к ним, а не через "?"
+        url=make_url(url).update_query_dict({"prepared_statement_cache_size": str(cache_size)}),
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+async_engine = create_async_engine(**engine_options(settings.DATABASE_URL_asyncpg))
 
 async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
+class ReplicaRouter:
+    # Чтение без требований read-your-writes уходит на здоровую реплику (round-robin).
+    # Реплика выпадает из ротации, если недоступна или отстает больше DB_REPLICA_MAX_LAG_SECONDS;
+    # если здоровых реплик нет — читаем с primary.
+    LAG_QUERY = text("""
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """)
+
+    def __init__(self, urls: list):
+        self.engines = [create_async_engine(**engine_options(url)) for url in urls]
+        self.factories = [async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                          for engine in self.engines]
+        self.healthy = [True] * len(self.engines)
+        self.lag = [0.0] * len(self.engines)
+        self.last_write = -float("inf")
+        self._next = 0
+
+    def wrote(self):
+        # После коммита записи в каталог: реплики увидят ее не сразу
+        self.last_write = time.monotonic()
+
+    def lagging(self) -> bool:
+        # Лаг здоровой реплики не больше DB_REPLICA_MAX_LAG_SECONDS на момент проверки, проверка — раз в
+        # DB_REPLICA_CHECK_SECONDS; в этом окне после записи реплика может отдать старые данные
+        window = settings.DB_REPLICA_MAX_LAG_SECONDS + settings.DB_REPLICA_CHECK_SECONDS
+        return time.monotonic() - self.last_write < window
+
+    def session_factory(self):
+        healthy = [factory for factory, ok in zip(self.factories, self.healthy) if ok]
+        if not healthy:
+            return async_session_factory
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next]
+
+    async def check(self):
+        for i, engine in enumerate(self.engines):
+            try:
+                async with engine.connect() as conn:
+                    lag = await asyncio.wait_for(conn.scalar(self.LAG_QUERY), settings.DB_REPLICA_CHECK_SECONDS)
+                self.lag[i] = float(lag)
+                self.healthy[i] = self.lag[i] <= settings.DB_REPLICA_MAX_LAG_SECONDS
+            except Exception as e:
+                print(f"Replica {i} is unavailable: {str(e)}")
+                self.healthy[i] = False
+
+    async def check_periodically(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(settings.DB_REPLICA_CHECK_SECONDS)
+
+    async def dispose(self):
+        for engine in self.engines:
+            await engine.dispose()
+
+
+replica_router = ReplicaRouter(settings.DB_REPLICA_URLS)
+
+
+def read_session(fresh: bool = False) -> AsyncSession:
+    # fresh — результат кэшируется под текущей catalog_version: сразу после локальной записи такие
+    # чтения идут на primary, иначе отставшая реплика закэширует старую выдачу под новой версией
+    if fresh and replica_router.lagging():
+        return async_session_factory()
+    return replica_router.session_factory()()
+
 class Base(DeclarativeBase):
     pass
 
+async def warm_pool(engine, statements: list, connections: int):
+    # Каждое соединение открывается параллельно и один раз выполняет горячие запросы,
+    # чтобы они попали в его кэш prepared statements до первого пользователя
+    async def warm():
+        async with engine.connect() as conn:
+            for statement in statements:
+                await conn.execute(statement)
+
+    await asyncio.gather(*[warm() for _ in range(connections)])
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_factory() as session:
         yield session
 
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session() as session:
+        yield session
+
 
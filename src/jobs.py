@@ -0,0 +1,152 @@
+import asyncio
+from datetime import timedelta
+
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Index, func, select, update, delete, text
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import settings
+from src.database import Base, async_session_factory
+from src.metrics import job_runs
+
+
+class Job(Base):
+    __tablename__ = 'job'
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    idempotency_key = Column(String, unique=True)  # повторный enqueue с тем же ключом ничего не добавляет
+    status = Column(String, nullable=False, default="pending", server_default="pending")  # pending | done | failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_error = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # Выборка очередной задачи идет только по pending строкам
+        Index("ix_job_pending_run_at", run_at, postgresql_where=text("status = 'pending'")),
+        # Счетчики watch_depth и очистка выполненных: без них оба запроса просматривают всю таблицу
+        Index("ix_job_open_status", status, postgresql_where=text("status IN ('pending', 'failed')")),
+        Index("ix_job_done_finished_at", finished_at, postgresql_where=text("status = 'done'")),
+    )
+
+
+class JobQueue:
+    # Очередь в таблице job. Задача добавляется в транзакции записи (enqueue) и видна воркерам
+    # только после ее коммита. Воркер берет строку FOR UPDATE SKIP LOCKED в короткой транзакции
+    # и сдвигает run_at на JOB_LEASE_SECONDS: пока задача выполняется, ни строка, ни соединение
+    # не заняты, а при падении процесса задачу после аренды возьмет другой воркер.
+    # Изменения обработчика в БД и статус задачи коммитятся вместе.
+    def __init__(self):
+        # kind -> async handler(session, payload); может вернуть корутинную функцию, которая
+        # выполнится после коммита (сброс кэшей и т.п.). Транзакция начинается с первого запроса
+        # обработчика, поэтому долгую подготовку (ресайз) он делает до обращения к session
+        self.handlers = {}
+        self.wakeup = asyncio.Event()
+        self.workers = []
+        self.depth = {}  # status -> количество строк, обновляется watch_depth
+
+    async def enqueue(self, session: AsyncSession, kind: str, payload: dict, key: str = None, delay: float = 0):
+        await self.enqueue_many(session, kind, [(payload, key)], delay)
+
+    async def enqueue_many(self, session: AsyncSession, kind: str, items: list, delay: float = 0):
+        # items: [(payload, idempotency_key)], один многострочный INSERT
+        if not items:
+            return
+        values = [{"kind": kind, "payload": payload, "idempotency_key": key,
+                   "run_at": func.now() + timedelta(seconds=delay)} for payload, key in items]
+        stmt = insert(Job).values(values).on_conflict_do_nothing(index_elements=[Job.idempotency_key])
+        await session.execute(stmt)
+
+    def notify(self):
+        # После коммита: будит воркеры этого процесса, остальные найдут задачу при следующем опросе
+        self.wakeup.set()
+
+    async def run_one(self) -> bool:
+        async with async_session_factory() as session:
+            async with session.begin():
+                stmt = (select(Job).where(Job.status == "pending", Job.run_at <= func.now())
+                        .order_by(Job.run_at).limit(1).with_for_update(skip_locked=True))
+                job = (await session.execute(stmt)).scalars().one_or_none()
+                if job is None:
+                    return False
+                # После коммита объект job истекает, нужные поля читаем сейчас
+                job_id, kind, payload, attempt = job.id, job.kind, job.payload, job.attempts + 1
+                await session.execute(update(Job).where(Job.id == job_id).values(
+                    attempts=attempt, run_at=func.now() + timedelta(seconds=settings.JOB_LEASE_SECONDS)))
+            # Задача своя, пока attempts не изменился: после истечения аренды ее мог взять другой воркер
+            mine = update(Job).where(Job.id == job_id, Job.attempts == attempt)
+
+            after = None
+            try:
+                async with session.begin():
+                    after = await self.handlers[kind](session, payload)
+                    done = await session.execute(
+                        mine.values(status="done", finished_at=func.now(), last_error=None))
+                    if not done.rowcount:
+                        raise RuntimeError("Job lease expired")
+                outcome = "done"
+            except Exception as e:
+                print(f"Error running job {job_id} ({kind}): {str(e)}")
+                after = None
+                values = {"last_error": str(e)[:1000]}
+                if attempt >= settings.JOB_MAX_ATTEMPTS:
+                    values.update(status="failed", finished_at=func.now())
+                    outcome = "failed"
+                else:
+                    # Экспоненциальная пауза перед следующей попыткой
+                    backoff = min(settings.JOB_BACKOFF_SECONDS * 2 ** (attempt - 1), settings.JOB_BACKOFF_MAX_SECONDS)
+                    values["run_at"] = func.now() + timedelta(seconds=backoff)
+                    outcome = "retry"
+                async with session.begin():
+                    await session.execute(mine.values(**values))
+        if after is not None:
+            await after()
+        job_runs.inc(kind=kind, outcome=outcome)
+        return True
+
+    async def work(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                while await self.run_one():
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error polling jobs: {str(e)}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def watch_depth(self):
+        while True:
+            try:
+                async with async_session_factory() as session:
+                    async with session.begin():
+                        rows = await session.execute(select(Job.status, func.count())
+                                                     .where(Job.status.in_(["pending", "failed"])).group_by(Job.status))
+                        self.depth = {"pending": 0, "failed": 0, **dict(rows.all())}
+                        # Выполненные задачи храним JOB_RETENTION_HOURS, ключи идемпотентности живут столько же
+                        await session.execute(delete(Job).where(
+                            Job.status == "done",
+                            Job.finished_at < func.now() - timedelta(hours=settings.JOB_RETENTION_HOURS)))
+            except Exception as e:
+                print(f"Error reading job queue depth: {str(e)}")
+            await asyncio.sleep(settings.JOB_METRICS_SECONDS)
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.work()) for _ in range(settings.JOB_WORKERS)]
+        self.workers.append(asyncio.create_task(self.watch_depth()))
+
+    async def stop(self):
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+
+job_queue = JobQueue()
@@ -1,4 +1,10 @@
-from fastapi import FastAPI, Depends
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, Request, HTTPException
+from fastapi.responses import PlainTextResponse, FileResponse, Response
+from fastapi.staticfiles import StaticFiles
 from fastapi_users import FastAPIUsers
 
 from src.auth.manager import get_user_manager
@@ -8,12 +14,97 @@ from src.auth.models import User
 
 from src.core import Core
 from src.products.router import router as products_router
+from src.chatas.router import router as chat_router
+from src.chatas.utils import hub
 from src.auth.base_config import current_user
+from src.cache import product_cache, listing_cache, listing_flight
+from src.config import settings
+from src.database import async_engine, replica_router, warm_pool
+from src.products.images import shutdown_pool
+from src.products.utils import not_modified
+from src.products.recommend import recommender
+from src.jobs import job_queue
+from src.assets import build_manifest, lookup_asset
+from src.metrics import (RequestStats, current_request, gauge_sources, instrument_engine, observe_request,
+                         render_metrics)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема обновляется до прогрева: горячие запросы ссылаются на новые колонки
+    if settings.DB_AUTO_UPGRADE:
+        await Core.upgrade_schema()
+    if settings.DB_POOL_PREWARM:
+        await warm_pool(async_engine, Core.hot_statements(), settings.DB_POOL_SIZE)
+    await asyncio.to_thread(build_manifest)
+    await hub.start()
+    job_queue.start()
+    background = [asyncio.create_task(Core.refresh_facets_periodically()),
+                  asyncio.create_task(Core.rebuild_recommendations_periodically()),
+                  asyncio.create_task(Core.purge_deleted_periodically())]
+    if replica_router.engines:
+        await replica_router.check()
+        background.append(asyncio.create_task(replica_router.check_periodically()))
+    yield
+    for task in background:
+        task.cancel()
+    await hub.stop()
+    await job_queue.stop()
+    shutdown_pool()
+    await replica_router.dispose()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Account shop",
+    lifespan=lifespan,
 )
 
+for engine in [async_engine, *replica_router.engines]:
+    instrument_engine(engine)
+gauge_sources.extend([
+    ("db_pool_checked_out", "Connections currently checked out",
+     lambda: [({}, async_engine.pool.checkedout())]),
+    ("db_pool_idle", "Idle connections in the pool",
+     lambda: [({}, async_engine.pool.checkedin())]),
+    ("db_replica_healthy", "1 if the replica is in the read rotation",
+     lambda: [({"replica": str(i)}, int(ok)) for i, ok in enumerate(replica_router.healthy)]),
+    ("db_replica_lag_seconds", "Replication lag seen by the last health check",
+     lambda: [({"replica": str(i)}, lag) for i, lag in enumerate(replica_router.lag)]),
+    ("cache_hits", "Cache hits",
+     lambda: [({"cache": "product"}, product_cache.hits), ({"cache": "listing"}, listing_cache.hits)]),
+    ("cache_misses", "Cache misses",
+     lambda: [({"cache": "product"}, product_cache.misses), ({"cache": "listing"}, listing_cache.misses)]),
+    ("cache_evictions", "Cache LRU evictions",
+     lambda: [({"cache": "product"}, product_cache.evictions), ({"cache": "listing"}, listing_cache.evictions)]),
+    ("chat_connections", "Open chat WebSocket connections",
+     lambda: [({}, hub.connections())]),
+    ("chat_dropped_deliveries", "Chat messages dropped for slow clients (client disconnected)",
+     lambda: [({}, hub.dropped)]),
+    ("chat_write_buffer", "Chat messages waiting for the write-behind flush",
+     lambda: [({}, len(hub.writer.buffer))]),
+    ("chat_write_dropped", "Chat messages not persisted because the write-behind buffer was full",
+     lambda: [({}, hub.writer.dropped)]),
+    ("recommend_index_size", "Products in the similar-products index",
+     lambda: [({}, recommender.index.size)]),
+    ("recommend_rebuilds", "Swaps of the similar-products index (local rebuilds and reloads from the shared file)",
+     lambda: [({}, recommender.rebuilds)]),
+    ("job_queue_depth", "Background jobs by status (pending, failed), refreshed every JOB_METRICS_SECONDS",
+     lambda: [({"status": status}, n) for status, n in job_queue.depth.items()]),
+    ("listing_coalesced_requests", "Listing misses served by an in-flight query",
+     lambda: [({}, listing_flight.coalesced)]),
+])
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    stats = RequestStats(request.scope)
+    token = current_request.set(stats)
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        observe_request(stats, time.perf_counter() - start)
+        current_request.reset(token)
+
 fastapi_users = FastAPIUsers[User, int](
     get_user_manager,
     [auth_backend],
@@ -32,12 +123,32 @@ app.include_router(
 )
 
 app.include_router(products_router)
+app.include_router(chat_router)
+app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.get("/")
 async def startup_event():
     # await Core.create_tables()
     return {"message": "rework db done"}
 
+@app.get("/assets/{name:path}")
+async def get_asset(name: str, request: Request):
+    # Разбор имени и проверка хэша читают файл — в потоке
+    asset = await asyncio.to_thread(lookup_asset, name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    path, digest = asset
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if not_modified(request.headers, headers["ETag"], None):
+        return Response(status_code=304, headers=headers)
+    # FileResponse сам обслуживает Range и отдает файл через pathsend (sendfile), если сервер это умеет
+    return FileResponse(path, headers=headers)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.get("/users/me")
 async def read_users_me(user: User = Depends(current_user)):
     print(user.id)
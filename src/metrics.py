@@ -0,0 +1,131 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from src.config import settings
+
+logger = logging.getLogger("acc_trade.sql")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}  # labels -> [счетчики по бакетам, сумма, количество]
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.series.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.series[key] = self.series.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(key)} {value}" for key, value in self.series.items()]
+        return lines
+
+
+def format_labels(key: tuple) -> str:
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+request_latency = Histogram("http_request_duration_seconds", "Request latency by route", LATENCY_BUCKETS)
+request_queries = Histogram("http_request_sql_queries", "SQL statements per request", QUERY_BUCKETS)
+request_db_time = Histogram("http_request_db_seconds", "Total DB time per request", LATENCY_BUCKETS)
+slow_queries = Counter("sql_slow_queries_total", "SQL statements slower than SLOW_QUERY_SECONDS")
+pool_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+                      LATENCY_BUCKETS)
+job_runs = Counter("jobs_processed_total", "Background jobs processed, by kind and outcome")
+products_purged = Counter("products_purged_total", "Soft-deleted products removed by the purger")
+
+# Gauges снимаются в момент отдачи /metrics
+gauge_sources = []
+
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "db_time")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+
+    @property
+    def route(self) -> str:
+        # Шаблон пути (/products/item/{id}), а не сам путь — чтобы не плодить серии
+        route = self.scope.get("route")
+        return getattr(route, "path", "unmatched")
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        stats = current_request.get()
+        route = stats.route if stats else "-"
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        if elapsed >= settings.SLOW_QUERY_SECONDS:
+            slow_queries.inc(route=route)
+            logger.warning("slow query %.3fs on %s: %s", elapsed, route, " ".join(statement.split())[:500])
+
+
+def observe_request(stats: RequestStats, elapsed: float):
+    request_latency.observe(elapsed, route=stats.route)
+    request_queries.observe(stats.queries, route=stats.route)
+    request_db_time.observe(stats.db_time, route=stats.route)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (request_latency, request_queries, request_db_time, slow_queries, pool_wait, job_runs,
+                   products_purged):
+        lines += metric.render()
+    for name, help_text, read in gauge_sources:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, value in read():
+            lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,9 @@
+import hashlib
 from typing import Dict
 
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Index, DateTime, Computed, MetaData, Table, func
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.ext.declarative import declarative_base
 
 from src.database import Base
@@ -14,7 +15,8 @@ class Image(Base):
     id = Column(Integer, primary_key=True)
     path = Column(String, nullable=False)
     description = Column(String, nullable=True)
-    product_id = Column(Integer, ForeignKey('product.id'))
+    product_id = Column(Integer, ForeignKey('product.id'), index=True)
+    variants = Column(JSONB)  # Уменьшенные копии: [{"url", "width", "height", "format"}]
 
     product = relationship('Product', back_populates='images')
 
@@ -22,12 +24,140 @@ class Product(Base):
     __tablename__ = 'product'
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String)
-    price = Column(Integer)
+    # Ключи keyset пагинации NOT NULL: NULL в (price, id) < (...) дает NULL, и страницы обрывались
+    price = Column(Integer, nullable=False, server_default="0")
     description = Column(String)
     tags = Column(String)
+    tag_list = Column(ARRAY(String))  # Нормализованные теги из tags, для поиска по GIN индексу
     main_img = Column(String)
+    main_img_variants = Column(JSONB)
     game_rating = Column(JSONB)  # JSON тип для хранения сложных структур данных
+    rating = Column(Integer, nullable=False, server_default="0")  # Копия game_rating['rating'] для сортировки по индексу
     id_user = Column(Integer, ForeignKey('user.id'))
 
     images = relationship("Image", back_populates="product")
     output_data = Column(JSONB)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # +1 при каждой правке продукта
+    # +1 при записи производных полей (варианты картинок): меняет ETag ответа, но не версию для If-Match
+    media_version = Column(Integer, nullable=False, default=0, server_default="0")
+    deleted_at = Column(DateTime(timezone=True))  # tombstone: продукт удален, строку потом уберет purge_deleted
+    # Полнотекстовый индекс по name + description; генерируется в БД, поэтому всегда актуален
+    search_vector = deferred(Column(TSVECTOR, Computed(
+        "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))", persisted=True)))
+
+    __table_args__ = (
+        # Выдача читает только живые строки, поэтому ее индексы частичные: WHERE deleted_at IS NULL
+        Index("ix_product_live_tag_list", "tag_list", postgresql_using="gin", postgresql_where=deleted_at.is_(None)),
+        # Составные индексы под keyset пагинацию: (ключ сортировки, id)
+        Index("ix_product_live_price_id", price, id, postgresql_where=deleted_at.is_(None)),
+        Index("ix_product_live_rating_id", rating, id, postgresql_where=deleted_at.is_(None)),
+        Index("ix_product_live_id_user_id", id_user, id, postgresql_where=deleted_at.is_(None)),
+        Index("ix_product_deleted_at", deleted_at, postgresql_where=deleted_at.isnot(None)),  # очередь purge
+        Index("ix_product_search_vector", "search_vector", postgresql_using="gin"),
+        # Триграммы (pg_trgm) для нечеткого и префиксного поиска по названию
+        Index("ix_product_name_trgm", name, postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+    )
+    # updated_at и прочие серверные значения приходят в RETURNING того же INSERT
+    __mapper_args__ = {"eager_defaults": True}
+
+
+# Границы корзин для фасетов (width_bucket): 0 — ниже первой границы, len — от последней и выше
+PRICE_BUCKETS = (0, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+RATING_BUCKETS = (0, 500, 1000, 1500, 2000, 2500, 3000)
+
+# Глобальные счетчики фасетов. Это materialized view, а не таблица моделей — отдельная MetaData,
+# чтобы create_all ее не создавал. Обновляется REFRESH ... CONCURRENTLY по расписанию.
+product_facets = Table(
+    "product_facets", MetaData(),
+    Column("facet", String),
+    Column("bucket", String),
+    Column("n", BigInteger),
+)
+
+FACETS_VIEW_STATEMENTS = [
+    f"""
+    CREATE MATERIALIZED VIEW IF NOT EXISTS product_facets AS
+    SELECT 'tag' AS facet, tag AS bucket, count(*) AS n
+    FROM product, unnest(tag_list) AS tag
+    WHERE deleted_at IS NULL
+    GROUP BY tag
+    UNION ALL
+    SELECT 'price', width_bucket(price, ARRAY{list(PRICE_BUCKETS)})::text, count(*)
+    FROM product WHERE price IS NOT NULL AND deleted_at IS NULL
+    GROUP BY 2
+    UNION ALL
+    SELECT 'rating', width_bucket(rating, ARRAY{list(RATING_BUCKETS)})::text, count(*)
+    FROM product WHERE rating IS NOT NULL AND deleted_at IS NULL
+    GROUP BY 2
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_product_facets ON product_facets (facet, bucket)",
+]
+
+class SchemaUpgrade(Base):
+    # Примененные SCHEMA_UPGRADES: повторный запуск не берет блокировки на product, если применять нечего
+    __tablename__ = 'schema_upgrade'
+
+    key = Column(String, primary_key=True)  # upgrade_key(statement)
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+def upgrade_key(statement: str) -> str:
+    return hashlib.sha1(" ".join(statement.split()).encode()).hexdigest()
+
+
+# Идемпотентные изменения схемы для уже существующих баз (create_all не трогает готовые таблицы)
+SCHEMA_UPGRADES = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS tag_list VARCHAR[]",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_product_live_tag_list ON product USING gin (tag_list) WHERE deleted_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_product_live_price_id ON product (price, id) WHERE deleted_at IS NULL",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS rating INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_image_product_id ON image (product_id)",
+    "CREATE INDEX IF NOT EXISTS ix_product_live_id_user_id ON product (id_user, id) WHERE deleted_at IS NULL",
+    """
+    ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_product_name_trgm ON product USING gin (name gin_trgm_ops)",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_product_updated_at ON product (updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_product_live_rating_id ON product (rating, id) WHERE deleted_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_product_deleted_at ON product (deleted_at) WHERE deleted_at IS NOT NULL",
+    # Полные индексы заменены частичными выше
+    "DROP INDEX IF EXISTS ix_product_tag_list",
+    "DROP INDEX IF EXISTS ix_product_price_id",
+    "DROP INDEX IF EXISTS ix_product_rating_id",
+    "DROP INDEX IF EXISTS ix_product_id_user_id",
+    # Одноразовый backfill тегов из строки tags
+    r"""
+    UPDATE product
+    SET tag_list = ARRAY(SELECT DISTINCT m[1] FROM regexp_matches(coalesce(tags, ''), '(\w+)', 'g') AS m)
+    WHERE tag_list IS NULL
+    """,
+    "UPDATE product SET rating = (game_rating ->> 'rating')::integer WHERE rating IS NULL AND game_rating ? 'rating'",
+    # Оставшиеся NULL в ключах сортировки -> 0, дальше колонки NOT NULL
+    "UPDATE product SET price = 0 WHERE price IS NULL",
+    "UPDATE product SET rating = 0 WHERE rating IS NULL",
+    "ALTER TABLE product ALTER COLUMN price SET DEFAULT 0, ALTER COLUMN price SET NOT NULL",
+    "ALTER TABLE product ALTER COLUMN rating SET DEFAULT 0, ALTER COLUMN rating SET NOT NULL",
+    # View без фильтра deleted_at пересоздается
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = 'product_facets'
+                   AND definition NOT LIKE '%deleted_at%') THEN
+            DROP MATERIALIZED VIEW product_facets;
+        END IF;
+    END $$
+    """,
+    *FACETS_VIEW_STATEMENTS,
+    "ALTER TABLE image ADD COLUMN IF NOT EXISTS variants JSONB",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS main_img_variants JSONB",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE product ADD COLUMN IF NOT EXISTS media_version INTEGER NOT NULL DEFAULT 0",
+    "CREATE INDEX IF NOT EXISTS ix_job_open_status ON job (status) WHERE status IN ('pending', 'failed')",
+    "CREATE INDEX IF NOT EXISTS ix_job_done_finished_at ON job (finished_at) WHERE status = 'done'",
+]
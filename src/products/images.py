@@ -0,0 +1,72 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src.assets import resolve, file_digest
+from src.config import settings
+
+VARIANT_WIDTHS = (160, 320, 640)
+VARIANT_FORMATS = {"webp": "webp", "jpeg": "jpg"}
+VARIANTS_DIR = "static/products/variants"
+
+_pool = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def make_variants(path: str, out_dir: str = VARIANTS_DIR) -> list:
+    # Выполняется в процессе пула: ресайз CPU-bound и не должен блокировать event loop
+    from PIL import Image as PILImage
+
+    # Путь приходит от клиента (main_img, Image.path): читаем только файлы внутри static/
+    real = resolve(path)
+    if real is None:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    # Имя по хэшу содержимого: одинаковые basename из разных каталогов не перезаписывают друг друга
+    stem = file_digest(real)
+
+    outputs = [(width, fmt, os.path.join(out_dir, f"{stem}_{width}.{ext}"))
+               for width in VARIANT_WIDTHS for fmt, ext in VARIANT_FORMATS.items()]
+
+    # Тот же файл у нескольких продуктов (bulk импорт): варианты уже есть, ресайз не нужен
+    stored = all(os.path.exists(out) for _, _, out in outputs)
+
+    with PILImage.open(real) as source:
+        size = source.size  # только заголовок, без декодирования
+        frame = None
+        if not stored:
+            source.seek(0)  # у GIF берем первый кадр
+            frame = source.convert("RGB")
+
+    variants = []
+    resized = {}
+    for width, fmt, out in outputs:
+        target = min(width, size[0])
+        height = max(1, round(size[1] * target / size[0]))
+        if frame is not None:
+            if width not in resized:
+                resized[width] = frame.resize((target, height), PILImage.LANCZOS)
+            # Запись через временный файл: существующий файл варианта всегда записан целиком
+            tmp = f"{out}.{os.getpid()}.tmp"
+            resized[width].save(tmp, fmt.upper(), quality=80)
+            os.replace(tmp, out)
+        variants.append({"url": "/" + out.replace(os.sep, "/"), "width": target, "height": height, "format": fmt})
+    return variants
+
+
+async def process_image(path: str) -> list:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_pool(), make_variants, path.lstrip("/"))
@@ -0,0 +1,395 @@
+import asyncio
+import math
+import os
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+from src.config import settings
+
+PRICE_WEIGHT = 0.5
+RATING_WEIGHT = 0.5
+BATCH_CELLS = 2 ** 24  # размер матрицы сходств на одну пачку (float32, ~64 МБ)
+MAX_TAGS = 16  # тегов словаря в признаках продукта, самые редкие; остальные не учитываются
+RARE_TAGS = 3  # кандидаты в соседи строки берутся из списков ее самых редких тегов
+CLOCK_SKEW = 5  # запас в секундах при доигрывании изменений на индексе с другого воркера
+INDEX_FORMAT = 2  # версия файла индекса; файл другой версии пересобирается
+
+
+class RecommendIndex:
+    # Признаки продукта: теги (по словарю из vocab_size самых частых, вес idf, нормированы), log цены
+    # и рейтинг; вектор нормирован, поэтому скалярное произведение — косинусная близость. Хранятся
+    # разреженно: до MAX_TAGS колонок словаря с весами и два плотных признака, плотные строки собираются
+    # только на время расчета (dense). Для каждой строки хранятся top_k соседей (id продуктов) по убыванию
+    # близости, -1 — пусто. Соседи ищутся среди продуктов с теми же редкими тегами (списки postings
+    # поддерживаются при каждом изменении), не больше candidates на тег: ни сборка, ни обновление
+    # не сравнивают строку со всем каталогом.
+    # Удаленные и измененные продукты из чужих списков соседей не вычищаются (это просмотр всего индекса):
+    # similar пропускает удаленные id, устаревшая оценка заменяется, когда продукт снова попадает
+    # в кандидаты, и пропадает при следующей полной пересборке.
+    # Методы выполняются в потоке (Recommender), не в event loop.
+    def __init__(self, top_k: int, candidates: int, vocab: dict = None, idf=None, price_scale: float = 1.0,
+                 rating_scale: float = 1.0):
+        self.top_k = top_k
+        self.candidates = candidates
+        self.vocab = vocab or {}
+        self.idf = idf if idf is not None else np.zeros(0, dtype=np.float32)
+        self.price_scale = price_scale
+        self.rating_scale = rating_scale
+        self.dim = len(self.vocab) + 2
+        self.size = 0
+        self.rows = {}  # id продукта -> строка
+        self.rng = np.random.default_rng(0)
+        self.ids = np.empty(0, dtype=np.int32)
+        self.tag_cols = np.empty((0, MAX_TAGS), dtype=np.int16)  # -1 — пусто, по убыванию idf
+        self.tag_weights = np.empty((0, MAX_TAGS), dtype=np.float32)
+        self.tail = np.empty((0, 2), dtype=np.float32)  # цена, рейтинг
+        self.neighbours = np.empty((0, top_k), dtype=np.int32)
+        self.scores = np.empty((0, top_k), dtype=np.float32)
+        self.slots = np.empty((0, MAX_TAGS), dtype=np.int32)  # позиция строки в postings ее тега
+        self.postings = [np.empty(0, dtype=np.int32) for _ in self.vocab]  # колонка -> строки, с запасом
+        self.posting_sizes = np.zeros(len(self.vocab), dtype=np.int64)
+
+    arrays = ("ids", "tag_cols", "tag_weights", "tail", "neighbours", "scores")  # сохраняются в файл
+
+    @classmethod
+    def build(cls, entries: list, top_k: int, vocab_size: int, candidates: int) -> "RecommendIndex":
+        # entries: [(id, tag_list, price, rating)]; выполняется в потоке, живой индекс не трогает
+        df = Counter(tag for _, tags, _, _ in entries for tag in set(tags or ()))
+        vocab = {tag: col for col, (tag, _) in enumerate(df.most_common(min(vocab_size, 2 ** 15 - 1)))}
+        n = max(len(entries), 1)
+        idf = np.array([math.log(n / (1 + df[tag])) + 1 for tag in vocab], dtype=np.float32)
+        price_scale = max((math.log1p(max(price or 0, 0)) for _, _, price, _ in entries), default=0) or 1.0
+        rating_scale = max((max(rating or 0, 0) for _, _, _, rating in entries), default=0) or 1.0
+
+        index = cls(top_k, candidates, vocab, idf, price_scale, rating_scale)
+        index._place(entries, post=False)
+        index._index_postings()
+        rows = np.arange(index.size)
+        index._link_queries(index._queries(rows, index._pairs(rows)), reverse=False)
+        return index
+
+    def save(self, path: str, mtime: float = None):
+        # Запись во временный файл и os.replace: читатели видят либо старый, либо новый индекс целиком
+        n = self.size
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, format=INDEX_FORMAT, top_k=self.top_k, tags=np.array(list(self.vocab), dtype=str),
+                     idf=self.idf, scales=np.array([self.price_scale, self.rating_scale]),
+                     **{name: getattr(self, name)[:n] for name in self.arrays})
+        if mtime is not None:
+            os.utime(tmp, (mtime, mtime))
+        os.replace(tmp, path)
+
+    @staticmethod
+    def compatible(data, top_k: int) -> bool:
+        # Файл старого формата или с другим top_k не загружается, а пересобирается
+        return "format" in data and int(data["format"]) == INDEX_FORMAT and int(data["top_k"]) == top_k
+
+    @classmethod
+    def load(cls, path: str, top_k: int, candidates: int) -> "RecommendIndex":
+        with np.load(path) as data:
+            if not cls.compatible(data, top_k):
+                raise ValueError(f"Index in {path} has another format or top_k")
+            vocab = {tag: col for col, tag in enumerate(data["tags"].tolist())}
+            price_scale, rating_scale = data["scales"].tolist()
+            index = cls(top_k, candidates, vocab, data["idf"], price_scale, rating_scale)
+            for name in cls.arrays:
+                setattr(index, name, data[name])
+        index.size = len(index.ids)
+        index.rows = dict(zip(index.ids.tolist(), range(index.size)))
+        index.slots = np.full(index.tag_cols.shape, -1, dtype=np.int32)
+        index._index_postings()
+        return index
+
+    def encode(self, tags, price, rating) -> tuple:
+        # (колонки тегов, веса, [цена, рейтинг]) нормированного вектора продукта
+        cols = sorted({self.vocab[tag] for tag in tags or () if tag in self.vocab}, key=lambda col: -self.idf[col])
+        cols = np.array(cols[:MAX_TAGS], dtype=np.int16)
+        weights = self.idf[cols].astype(np.float32)
+        if len(cols):
+            weights /= np.linalg.norm(weights)
+        tail = np.array([PRICE_WEIGHT * min(math.log1p(max(price or 0, 0)) / self.price_scale, 1.0),
+                         RATING_WEIGHT * min(max(rating or 0, 0) / self.rating_scale, 1.0)], dtype=np.float32)
+        norm = math.sqrt(float(weights @ weights + tail @ tail))
+        if norm:
+            weights, tail = weights / norm, tail / norm
+        return cols, weights, tail
+
+    def dense(self, rows):
+        # Плотные векторы строк (len(rows), dim) для матричного умножения
+        out = np.zeros((len(rows), self.dim), dtype=np.float32)
+        cols = self.tag_cols[rows]
+        mask = cols >= 0
+        out[np.nonzero(mask)[0], cols[mask]] = self.tag_weights[rows][mask]
+        out[:, -2:] = self.tail[rows]
+        return out
+
+    def posting(self, col: int):
+        return self.postings[col][:self.posting_sizes[col]]
+
+    def _index_postings(self):
+        # postings и slots по всем строкам сразу (сборка, загрузка из файла)
+        rows, cols, k = self._pairs(np.arange(self.size))
+        by_col = np.argsort(cols, kind="stable")
+        bounds = np.searchsorted(cols[by_col], np.arange(len(self.vocab) + 1))
+        self.postings = [rows[by_col[bounds[c]:bounds[c + 1]]].astype(np.int32) for c in range(len(self.vocab))]
+        self.posting_sizes = np.diff(bounds)
+        self.slots[rows[by_col], k[by_col]] = np.arange(len(rows)) - bounds[cols[by_col]]
+
+    def _post(self, row: int):
+        for k in np.nonzero(self.tag_cols[row] >= 0)[0]:
+            col = self.tag_cols[row, k]
+            size = self.posting_sizes[col]
+            if size == len(self.postings[col]):
+                grown = np.empty(max(16, 2 * size), dtype=np.int32)
+                grown[:size] = self.postings[col]
+                self.postings[col] = grown
+            self.postings[col][size] = row
+            self.slots[row, k] = size
+            self.posting_sizes[col] += 1
+
+    def _unpost(self, row: int):
+        # Последний элемент списка переезжает на место строки
+        for k in np.nonzero(self.tag_cols[row] >= 0)[0]:
+            col = self.tag_cols[row, k]
+            slot, last = self.slots[row, k], self.posting_sizes[col] - 1
+            moved = self.postings[col][last]
+            self.postings[col][slot] = moved
+            self.slots[moved, self.tag_cols[moved] == col] = slot
+            self.posting_sizes[col] -= 1
+            self.slots[row, k] = -1
+
+    def _grow(self, capacity: int):
+        if capacity <= len(self.ids):
+            return
+        capacity = max(capacity, 2 * len(self.ids), 16)
+        for name, fill in (("ids", -1), ("tag_cols", -1), ("tag_weights", 0), ("tail", 0), ("neighbours", -1),
+                           ("scores", -np.inf), ("slots", -1)):
+            old = getattr(self, name)
+            new = np.full((capacity, *old.shape[1:]), fill, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _top(self, scores, ids):
+        # Лучшие top_k по строкам scores; ids — id кандидатов (вектор по столбцам или матрица как scores)
+        m = scores.shape[0]
+        out_ids = np.full((m, self.top_k), -1, dtype=self.neighbours.dtype)
+        out_scores = np.full((m, self.top_k), -np.inf, dtype=np.float32)
+        k = min(self.top_k, scores.shape[1])
+        if k == 0:
+            return out_ids, out_scores
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(scores, idx, axis=1)
+        order = np.argsort(-top, axis=1)
+        idx = np.take_along_axis(idx, order, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_ids = ids[idx] if ids.ndim == 1 else np.take_along_axis(ids, idx, axis=1)
+        out_ids[:, :k] = np.where(np.isfinite(top), top_ids, -1)
+        out_scores[:, :k] = top
+        return out_ids, out_scores
+
+    def _merge(self, rows, ids, scores):
+        # Лучшие top_k из новых кандидатов (ids, scores — матрицы как у rows) и текущих соседей rows
+        new_ids, new_scores = self._top(scores, ids)
+        ids = np.concatenate([new_ids, self.neighbours[rows]], axis=1)
+        scores = np.concatenate([new_scores, self.scores[rows]], axis=1)
+        # Повтор id в строке (кандидат пришел через несколько тегов или уже был соседом) не должен
+        # занимать место соседа; остается первое вхождение — свежая оценка
+        order = np.argsort(ids, axis=1, kind="stable")
+        sorted_ids = np.take_along_axis(ids, order, axis=1)
+        repeated = np.zeros(sorted_ids.shape, dtype=bool)
+        repeated[:, 1:] = sorted_ids[:, 1:] == sorted_ids[:, :-1]
+        np.put_along_axis(scores, order, np.where(repeated, -np.inf, np.take_along_axis(scores, order, axis=1)), axis=1)
+        self.neighbours[rows], self.scores[rows] = self._top(scores, ids)
+
+    def _pairs(self, rows):
+        # (строки, колонки тегов, номер тега в строке) для rows; у строки теги идут по убыванию idf
+        k_rows, k = np.nonzero(self.tag_cols[rows] >= 0)
+        return rows[k_rows], self.tag_cols[rows[k_rows], k].astype(np.int64), k
+
+    def _queries(self, rows, pairs) -> list:
+        # [(строки, кандидаты)]: строки с тегом среди RARE_TAGS самых редких сравниваются с продуктами
+        # этого тега, строки без тегов из словаря — со случайной выборкой каталога (None)
+        pair_rows, cols, rank = pairs
+        rare = rank < RARE_TAGS
+        order = np.argsort(cols[rare], kind="stable")
+        query_rows, query_cols = pair_rows[rare][order], cols[rare][order]
+        starts = np.flatnonzero(np.r_[True, query_cols[1:] != query_cols[:-1]]) if len(query_cols) else []
+        queries = [(query, self.posting(query_cols[start]))
+                   for start, query in zip(starts, np.split(query_rows, starts[1:]))]
+        untagged = np.setdiff1d(rows, pair_rows)
+        if len(untagged):
+            queries.append((untagged, None))
+        return queries
+
+    def _link_queries(self, queries: list, reverse: bool):
+        # Работа ~ строки * RARE_TAGS * candidates * dim. reverse: кандидатам строки подмешиваются
+        # как соседи, если они ближе их текущего последнего соседа (при полной сборке не нужно)
+        for query, pool in queries:
+            if pool is None:
+                pool = np.sort(self.rng.choice(self.size, min(self.candidates, self.size), replace=False))
+            elif len(pool) > self.candidates:
+                pool = np.sort(self.rng.choice(pool, self.candidates, replace=False))
+            if not len(pool):
+                continue
+            pool_features = self.dense(pool).T
+            batch = max(1, BATCH_CELLS // len(pool))
+            for start in range(0, len(query), batch):
+                part = query[start:start + batch]
+                sims = self.dense(part) @ pool_features
+                sims[part[:, None] == pool[None, :]] = -np.inf
+                self._merge(part, np.broadcast_to(self.ids[pool], sims.shape), sims)
+                if not reverse:
+                    continue
+                back = sims.T
+                targets = np.nonzero((back > self.scores[pool, -1:]).any(axis=1))[0]
+                if len(targets):
+                    self._merge(pool[targets], np.broadcast_to(self.ids[part], (len(targets), len(part))),
+                                back[targets])
+
+    def _place(self, entries: list, post: bool = True):
+        # Строки и признаки для entries без пересчета соседей
+        rows = []
+        for p_id, tags, price, rating in entries:
+            row = self.rows.get(p_id)
+            if row is None:
+                self._grow(self.size + 1)
+                row = self.rows[p_id] = self.size
+                self.ids[row] = p_id
+                self.slots[row] = -1
+                self.size += 1
+            elif post:
+                self._unpost(row)
+            cols, weights, tail = self.encode(tags, price, rating)
+            self.tag_cols[row] = -1
+            self.tag_weights[row] = 0
+            self.tag_cols[row, :len(cols)] = cols
+            self.tag_weights[row, :len(cols)] = weights
+            self.tail[row] = tail
+            if post:
+                self._post(row)
+            rows.append(row)
+        return rows
+
+    def upsert(self, entries: list):
+        # entries: [(id, tag_list, price, rating)]; новые и измененные продукты
+        rows = self._place(entries)
+        if not rows:
+            return
+        rows = np.unique(rows)
+        self.neighbours[rows] = -1
+        self.scores[rows] = -np.inf
+        self._link_queries(self._queries(rows, self._pairs(rows)), reverse=True)
+
+    def remove(self, ids: list):
+        for p_id in ids:
+            row = self.rows.pop(p_id, None)
+            if row is None:
+                continue
+            self._unpost(row)
+            # Последняя строка переезжает на место удаленной
+            last = self.size - 1
+            if row != last:
+                for k in np.nonzero(self.tag_cols[last] >= 0)[0]:
+                    self.postings[self.tag_cols[last, k]][self.slots[last, k]] = row
+                for name in (*self.arrays, "slots"):
+                    array = getattr(self, name)
+                    array[row] = array[last]
+                self.rows[int(self.ids[row])] = row
+            self.size -= 1
+
+    def similar(self, p_id: int, limit: int) -> list:
+        row = self.rows.get(p_id)
+        if row is None:
+            return []
+        found = [(int(n_id), float(score)) for n_id, score in zip(self.neighbours[row], self.scores[row])
+                 if n_id != -1 and int(n_id) in self.rows]
+        return found[:limit]
+
+
+class Recommender:
+    # Изменения индекса идут по очереди под lock и всегда в потоке: даже одна строка стоит
+    # RARE_TAGS * candidates * dim. similar читает индекс без lock — во время изменения список соседей
+    # может на мгновение быть неполным, это допустимо. Полный индекс собирает один воркер и сохраняет
+    # в файл, остальные загружают файл (Core.rebuild_recommendations_periodically). Локальные изменения
+    # хранятся в log и доигрываются на новом индексе, если они новее снимка каталога, по которому он собран.
+    def __init__(self, top_k: int, vocab_size: int, candidates: int):
+        self.top_k = top_k
+        self.vocab_size = vocab_size
+        self.candidates = candidates
+        self.index = RecommendIndex(top_k, candidates)
+        self.lock = asyncio.Lock()
+        self.log = deque()  # (time.time(), method, args)
+        self.loaded = None  # mtime файла, из которого загружен или в который сохранен текущий индекс
+        self.rebuilds = 0
+
+    async def _apply(self, index: RecommendIndex, method: str, args: list):
+        await asyncio.to_thread(getattr(index, method), args)
+
+    def _record(self, method: str, args: list):
+        now = time.time()
+        self.log.append((now, method, args))
+        while self.log and self.log[0][0] < now - 2 * settings.RECOMMEND_REBUILD_SECONDS:
+            self.log.popleft()
+
+    async def upsert(self, entries: list):
+        async with self.lock:
+            await self._apply(self.index, "upsert", entries)
+            self._record("upsert", entries)
+
+    async def remove(self, ids: list):
+        async with self.lock:
+            await self._apply(self.index, "remove", ids)
+            self._record("remove", ids)
+
+    def similar(self, p_id: int, limit: int) -> list:
+        return self.index.similar(p_id, limit)
+
+    async def _swap(self, index: RecommendIndex, snapshot: float):
+        # Повтор upsert/remove, уже попавших в снимок, безвреден, поэтому берем с запасом
+        async with self.lock:
+            for at, method, args in list(self.log):
+                if at >= snapshot - CLOCK_SKEW:
+                    await self._apply(index, method, args)
+            self.index = index
+            self.rebuilds += 1
+
+    def index_age(self, path: str) -> float:
+        # Возраст снимка в файле; несовместимый или битый файл считается бесконечно старым
+        try:
+            modified = os.stat(path).st_mtime
+            with np.load(path) as data:
+                if not RecommendIndex.compatible(data, self.top_k):
+                    return math.inf
+        except Exception:
+            return math.inf
+        return time.time() - modified
+
+    async def rebuild(self, load, path: str):
+        # load — корутина, возвращающая [(id, tag_list, price, rating)] по всему каталогу.
+        # Время снимка пишется в mtime файла: по нему остальные воркеры доигрывают свои изменения.
+        snapshot = time.time()
+        entries = await load()
+        index = await asyncio.to_thread(RecommendIndex.build, entries, self.top_k, self.vocab_size, self.candidates)
+        await asyncio.to_thread(index.save, path, snapshot)
+        self.loaded = os.stat(path).st_mtime_ns
+        await self._swap(index, snapshot)
+
+    async def reload(self, path: str) -> bool:
+        # Индекс, собранный другим воркером; файл читается, только если он изменился с прошлой загрузки
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_mtime_ns == self.loaded:
+            return False
+        index = await asyncio.to_thread(RecommendIndex.load, path, self.top_k, self.candidates)
+        self.loaded = stat.st_mtime_ns
+        await self._swap(index, stat.st_mtime)
+        return True
+
+
+recommender = Recommender(settings.RECOMMEND_TOP_K, settings.RECOMMEND_VOCAB_SIZE, settings.RECOMMEND_CANDIDATES)
@@ -1,17 +1,23 @@
+from datetime import datetime
 from typing import List, Optional, Dict
 from functools import partial
-from fastapi import APIRouter, HTTPException, Depends
+
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Response, Request, Query, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.auth.models import User
-from src.database import get_async_session
+from src.database import get_read_session
 
 from src.core import Core
 from src.products.database import Product, Image
-from src.auth.base_config import current_user
-from src.products.utils import ImageCreate
+from src.auth.base_config import current_user_id
+from src.products.utils import (ImageCreate, product_to_dict, parse_import_rows, product_etag, parse_product_etag,
+                                http_date, listing_etag, listing_validators, validator_headers, not_modified)
+from src.cache import product_cache, listing_cache, listing_flight, catalog_version
 
 router = APIRouter(
     tags=["products"],
@@ -19,55 +25,145 @@ router = APIRouter(
 )
 
 
-def product_to_dict(product):
-    if isinstance(product, Product):
-        return {
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "description": product.description,
-            "tags": product.tags,
-            "main_img": product.main_img,
-            "game_rating": {
-                "rating": product.game_rating.get("rating", 0),
-                "description": product.game_rating.get("description", "")
-            } if product.game_rating else {},
-            "images": [img.path for img in product.images],
-            "id_user": product.id_user,
-            "output_data": product.output_data  # Добавим поле output_data
-        }
-    return {}
+def lean_response(items: list, headers: Optional[dict] = None) -> Response:
+    # Карточки — обычные dict, сериализуем orjson без прохода через response_model
+    return Response(orjson.dumps(items), media_type="application/json", headers=headers)
+
+
+def conditional_response(request: Request, items: list, headers: dict) -> Response:
+    # 304 без тела, если у клиента актуальная версия; иначе тело с ETag/Last-Modified
+    if not_modified(request.headers, headers["ETag"], headers.get("Last-Modified")):
+        return Response(status_code=304, headers=headers)
+    return lean_response(items, headers)
 
 
 @router.get("/")
-async def get_prd(fst_id: int, lst_id: int, session: AsyncSession = Depends(get_async_session)) -> List[dict]:
-    stmt = select(Product).where(Product.id.between(fst_id, lst_id)).options(selectinload(Product.images))
+async def get_prd(fst_id: int, lst_id: int, request: Request, response: Response, lean: bool = False,
+                  session: AsyncSession = Depends(get_read_session)) -> List[dict]:
+    if lean:
+        result = await session.execute(Core.card_select().where(Product.id.between(fst_id, lst_id), Core.live()))
+        cards = Core.rows_to_cards(result)
+        return conditional_response(request, cards, validator_headers(*listing_validators(cards)))
+
+    stmt = (select(Product).where(Product.id.between(fst_id, lst_id), Core.live())
+            .options(selectinload(Product.images)))
     result = await session.execute(stmt)
     items = result.scalars().all()
+    # Валидаторы считаются по ORM объектам, product_to_dict — только если ответ нужен целиком
+    stamps = [item.updated_at for item in items if item.updated_at]
+    headers = validator_headers(listing_etag((item.id, f"{item.version}.{item.media_version}") for item in items),
+                                http_date(max(stamps)) if stamps else None)
+    if not_modified(request.headers, headers["ETag"], headers.get("Last-Modified")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return [product_to_dict(item) for item in items]
 
 @router.get("/item/{id}")
-async def get_products_by_tags_and_id(id: int) -> List[dict]:
-    items = await Core.get_products_by_id(id)
-    if not items:
+async def get_products_by_tags_and_id(id: int, request: Request, response: Response) -> List[dict]:
+    if "if-none-match" in request.headers or "if-modified-since" in request.headers:
+        # Версия из кэша или по PK — карточка не собирается
+        validators = await Core.get_product_validators(id)
+        if validators is not None and not_modified(request.headers, *validators):
+            return Response(status_code=304, headers=validator_headers(*validators))
+
+    item = await Core.get_product_card(id)
+    if item is None:
         raise HTTPException(status_code=404, detail="Product not found with the given id")
 
-    return [product_to_dict(item) for item in items]
+    response.headers.update(validator_headers(product_etag(item["id"], item["version"], item["media_version"]),
+                                              http_date(item["updated_at"])))
+    return [item]
+
+@router.get("/item/{id}/similar")
+async def get_similar_products(id: int, limit: int = Query(10, ge=1, le=50)) -> List[dict]:
+    return await Core.similar_products(id, limit)
+
+@router.get("/items")
+async def get_products_by_ids(ids: List[int] = Query(...)) -> dict:
+    if len(ids) > 100:
+        raise HTTPException(status_code=400, detail="No more than 100 ids per request")
+
+    items, missing = await Core.get_product_cards(ids)
+    return {"items": items, "missing": missing}
+
+@router.get("/search")
+async def search_products(q: str, request: Request, tags: Optional[str] = None, method: str = "default", offset: int = 0,
+                          limit: int = 30, cursor: Optional[str] = None):
+    try:
+        items = await Core.search_cards(q, tags, method, offset, limit, cursor)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Для релевантности курсора нет — только offset
+    next_cursor = Core.next_cursor(method, items, limit) if method != "default" else None
+    headers = validator_headers(*listing_validators(items))
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return conditional_response(request, items, headers)
+
+@router.get("/facets")
+async def get_facets(tags: Optional[str] = None) -> dict:
+    return await Core.get_facets(tags)
+
+@router.get("/my")
+async def get_my_products(request: Request, response: Response, limit: int = 30, cursor: Optional[str] = None,
+                          user_id: int = Depends(current_user_id)) -> List[dict]:
+    try:
+        items, next_cursor = await Core.get_user_cards(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = validator_headers(*listing_validators(items))
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if not_modified(request.headers, headers["ETag"], headers.get("Last-Modified")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return items
+
+@router.get("/export")
+async def export_products(format: str = "ndjson", updated_since: Optional[datetime] = None):
+    media_types = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+    if format not in media_types:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    return StreamingResponse(Core.export_products(format, updated_since), media_type=media_types[format],
+                             headers={"Content-Disposition": f"attachment; filename=products.{format}"})
+
+@router.get("/cache/stats")
+async def cache_stats() -> dict:
+    return {
+        "product": product_cache.stats(),
+        "listing": {**listing_cache.stats(), "coalesced": listing_flight.coalesced,
+                    "catalog_version": catalog_version.value},
+    }
 
 @router.get("/{tags}/sorted/{method}")
-async def get_products_by_tags(tags: str, offset: int = 0, limit: int = 30, method: str = "default") -> List[dict]:
+async def get_products_by_tags(tags: str, request: Request, response: Response, offset: int = 0, limit: int = 30, method: str = "default",
+                               cursor: Optional[str] = None, lean: bool = False) -> List[dict]:
 
     try:
-        items = await Core.sorted_products(method, tags, offset, limit)
+        page = await Core.search_page(method, tags, offset, limit, cursor, lean)
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    return [product_to_dict(item) for item in items]
+    # Курсор следующей страницы: передайте его в ?cursor= вместо offset
+    headers = validator_headers(page["etag"], page["last_modified"])
+    if page["next_cursor"]:
+        headers["X-Next-Cursor"] = page["next_cursor"]
+    # Валидаторы посчитаны вместе со страницей и лежат в кэше: на 304 ничего не сериализуется
+    if not_modified(request.headers, headers["ETag"], headers.get("Last-Modified")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    if lean:
+        return lean_response(page["items"], headers)
+    return page["items"]
 
 @router.post("/add/item")
 async def add_product(name: str, price: int, description: str, tags: str, main_img: str, rating_elo: int,
-                      rating_name: str, username: str, email: str, password: str, user: User = Depends(current_user)) -> dict:
+                      rating_name: str, username: str, email: str, password: str, user_id: int = Depends(current_user_id)) -> dict:
     try:
         item = await Core.add_product({
             "name": name,
@@ -77,7 +173,7 @@ async def add_product(name: str, price: int, description: str, tags: str, main_i
             "main_img": main_img,
             "rating_elo": rating_elo,
             "rating_name": rating_name,
-            "id_user": user.id,
+            "id_user": user_id,
             "username": username,
             "email": email,
             "password": password
@@ -88,8 +184,16 @@ async def add_product(name: str, price: int, description: str, tags: str, main_i
 
     return product_to_dict(item)
 
+@router.post("/add/bulk")
+async def add_products_bulk(request: Request, format: str = "ndjson", user_id: int = Depends(current_user_id)) -> dict:
+    # Тело запроса — NDJSON или CSV с заголовком, поля как у /add/item
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+    return await Core.bulk_add_products(parse_import_rows(request.stream(), format), user_id)
+
 @router.post("/add/images/")
-async def create_image(image: ImageCreate, cur_user: User = Depends(current_user)):
+async def create_image(image: ImageCreate, user_id: int = Depends(current_user_id)):
     try:
         item = await Core.add_image(image)
     except Exception as e:
@@ -104,7 +208,7 @@ async def delete_product(id: int) -> dict:
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    return product_to_dict(item)
+    return item
 
 @router.put("/rework/item/{id_product}", response_model=dict)
 async def rework_product(
@@ -119,8 +223,20 @@ async def rework_product(
     username: str,
     email: str,
     password: str,
-    cur_user: User = Depends(current_user),
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    user_id: int = Depends(current_user_id),
 ):
+    # If-Match: ETag из GET /products/item/{id}; без заголовка или "*" — обновление без проверки версии
+    version = None
+    if if_match is not None and if_match.strip() != "*":
+        try:
+            etag_id, version = parse_product_etag(if_match)
+        except ValueError:
+            raise HTTPException(status_code=412, detail="If-Match must be a product ETag")
+        if etag_id != id_product:
+            raise HTTPException(status_code=412, detail="If-Match does not belong to this product")
+
     try:
         item = await Core.rework_product(id_product, {
             "name": name,
@@ -132,18 +248,25 @@ async def rework_product(
             "username": username,
             "email": email,
             "password": password
-        }, cur_user.id)
+        }, user_id, version)
+    except HTTPException as e:
+        if e.status_code == 412:
+            raise
+        raise HTTPException(status_code=400, detail=str(e.detail))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+    if isinstance(item, Product):
+        response.headers.update(validator_headers(product_etag(item.id, item.version, item.media_version),
+                                                  http_date(item.updated_at)))
     return product_to_dict(item)
 
 @router.get("/buy/item/{id}")
-async def buy_product(id: int, user: User = Depends(current_user)) -> dict:
+async def buy_product(id: int, user_id: int = Depends(current_user_id)) -> dict:
     try:
-        item = await Core.buy_product(id, user.id)
+        return await Core.buy_item(id, user_id)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-
-    return product_to_dict(item)
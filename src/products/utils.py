@@ -1,6 +1,250 @@
-from pydantic import BaseModel
+import base64
+import binascii
+import csv
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+
+from pydantic import BaseModel, Field, ValidationError
+
+from src.assets import asset_url, asset_variants
+from src.products.database import Product
+
+
+def split_tags(tags: str) -> list[str]:
+    # Те же границы слов, что и у \y в старом regex-фильтре
+    return list(dict.fromkeys(re.findall(r"\w+", tags or "")))
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def bucket_label(bounds: tuple, index: int) -> str:
+    if index <= 0:
+        return f"<{bounds[0]}"
+    if index >= len(bounds):
+        return f"{bounds[-1]}+"
+    return f"{bounds[index - 1]}-{bounds[index]}"
+
+
+def product_etag(p_id: int, version: int, media_version: int) -> str:
+    return f'"{p_id}-{version}.{media_version}"'
+
+
+def parse_product_etag(etag: str) -> tuple:
+    # '"<id>-<version>.<media_version>"' -> (id, version); ValueError, если это не ETag продукта.
+    # media_version для If-Match не важна: фоновая запись вариантов не конфликтует с правкой
+    p_id, _, versions = etag.strip().removeprefix("W/").strip('"').partition("-")
+    return int(p_id), int(versions.partition(".")[0])
+
+
+def listing_etag(pairs) -> str:
+    # Слабый ETag страницы: по (id, версии) карточек в порядке выдачи
+    digest = hashlib.sha1(",".join(f"{p_id}-{version}" for p_id, version in pairs).encode()).hexdigest()
+    return f'W/"{digest[:16]}"'
+
+
+def listing_validators(cards: list) -> tuple:
+    # (ETag, Last-Modified) для списка карточек
+    stamps = [card["updated_at"] for card in cards if card.get("updated_at")]
+    last_modified = http_date(max(stamps, key=datetime.fromisoformat)) if stamps else None
+    pairs = ((card["id"], f'{card["version"]}.{card.get("media_version", 0)}') for card in cards)
+    return listing_etag(pairs), last_modified
+
+
+def http_date(updated_at) -> Optional[str]:
+    if not updated_at:
+        return None
+    if isinstance(updated_at, str):
+        updated_at = datetime.fromisoformat(updated_at)
+    return format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+
+
+def validator_headers(etag: str, last_modified: Optional[str]) -> dict:
+    headers = {"ETag": etag}
+    if last_modified:
+        headers["Last-Modified"] = last_modified
+    return headers
+
+
+def not_modified(request_headers, etag: str, last_modified: Optional[str]) -> bool:
+    # If-None-Match (слабое сравнение) важнее If-Modified-Since
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 class ImageCreate(BaseModel):
     path: str
     description: str
     product_id: int
 
+
+INT32_MAX = 2 ** 31 - 1
+
+
+class ProductImportRow(BaseModel):
+    name: str
+    price: int = Field(ge=0, le=INT32_MAX)  # колонки Integer: переполнение ловим до INSERT, а не на всей пачке
+    description: str
+    tags: str
+    main_img: str
+    rating_elo: int = Field(ge=-INT32_MAX, le=INT32_MAX)
+    rating_name: str
+    username: str
+    email: str
+    password: str
+
+
+async def iter_lines(chunks):
+    # Строки в байтах: \n не встречается внутри многобайтных символов UTF-8, а декодирование
+    # идет по строке в parse_import_rows, чтобы битая кодировка была ошибкой одной строки
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+MAX_RECORD_LINES = 100  # строк в одной CSV записи; дальше незакрытая кавычка считается ошибкой записи
+
+
+def read_record(lines: list):
+    # Одна CSV запись из начала lines: (поля, сколько строк заняла, ошибка) или None, если записи нужны
+    # следующие строки. Где кончается запись, решает сам csv.reader: кавычка внутри поля без кавычек
+    # (b"c, 5" screen) — обычный символ, а не начало многострочного поля.
+    state = {"used": 0, "exhausted": False}
+
+    def feed():
+        for line in lines:
+            state["used"] += 1
+            yield line
+        state["exhausted"] = True
+
+    try:
+        fields = next(csv.reader(feed()))
+    except csv.Error as e:
+        return None, max(state["used"], 1), str(e)
+    if state["exhausted"]:
+        return None
+    return fields, state["used"], None
+
+
+def split_records(pending: list, final: bool):
+    # pending: [(строка, ошибка декодирования)]; отдает (поля или None, ошибка) для готовых записей
+    # и убирает их строки из pending. Запись, не закрытая за MAX_RECORD_LINES строк или к концу файла, —
+    # ошибка одной ее первой строки; остальные строки разбираются заново, а не пропадают вместе с ней.
+    while pending:
+        record = read_record([line for line, _ in pending])
+        if record is None:
+            if not final and len(pending) < MAX_RECORD_LINES:
+                return
+            record = None, 1, "Unterminated quoted field"
+        fields, used, error = record
+        error = next((line_error for _, line_error in pending[:used] if line_error), error)
+        del pending[:used]
+        yield fields, error
+
+
+async def parse_import_rows(chunks, fmt: str):
+    # Потоковый разбор NDJSON/CSV: отдает (номер записи, ProductImportRow или None, ошибка).
+    # В CSV поле в кавычках может содержать переводы строк.
+    header = None
+    row_no = 0
+    pending = []
+
+    def csv_rows(final: bool):
+        nonlocal header, row_no
+        for fields, error in split_records(pending, final):
+            if error is None and not "".join(fields).strip() and len(fields) <= 1:
+                continue  # пустая строка
+            if header is None:
+                header = fields
+                continue
+            row_no += 1
+            if error is not None:
+                yield row_no, None, error
+                continue
+            try:
+                yield row_no, ProductImportRow.model_validate(dict(zip(header, fields))), None
+            except ValidationError as e:
+                yield row_no, None, str(e)
+
+    async for raw in iter_lines(chunks):
+        try:
+            line, error = raw.decode(), None
+        except UnicodeDecodeError as e:
+            line, error = raw.decode(errors="replace"), f"Invalid UTF-8: {e}"
+        if fmt == "csv":
+            pending.append((line + "\n", error))
+            for row in csv_rows(final=False):
+                yield row
+            continue
+
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+        row_no += 1
+        if error is not None:
+            yield row_no, None, error
+            continue
+        try:
+            yield row_no, ProductImportRow.model_validate(json.loads(line)), None
+        except (ValueError, ValidationError) as e:
+            yield row_no, None, str(e)
+
+    for row in csv_rows(final=True):
+        yield row
+
+
+def product_to_dict(product):
+    if isinstance(product, Product):
+        return {
+            "id": product.id,
+            "name": product.name,
+            "price": product.price,
+            "description": product.description,
+            "tags": product.tags,
+            "main_img": product.main_img,
+            "main_img_url": asset_url(product.main_img),
+            "main_img_variants": asset_variants(product.main_img_variants),
+            "game_rating": {
+                "rating": product.game_rating.get("rating", 0),
+                "description": product.game_rating.get("description", "")
+            } if product.game_rating else {},
+            "images": [img.path for img in product.images],
+            "image_urls": [asset_url(img.path) for img in product.images],
+            "image_variants": [asset_variants(img.variants) for img in product.images],
+            "id_user": product.id_user,
+            "version": product.version,
+            "media_version": product.media_version,
+            "updated_at": product.updated_at.isoformat() if product.updated_at else None,
+            "output_data": product.output_data  # Добавим поле output_data
+        }
+    return {}
@@ -0,0 +1,21 @@
+# Применение SCHEMA_UPGRADES к существующей базе без пересоздания таблиц; запускается один раз
+# при деплое, до рестарта воркеров.
+#   python -m src.upgrade
+import asyncio
+
+import src.main  # noqa: F401 — регистрирует все модели в Base.metadata
+from src.core import Core
+from src.database import async_engine
+
+
+def main():
+    async def run():
+        applied = await Core.upgrade_schema()
+        await async_engine.dispose()
+        print(f"applied {applied} schema upgrades" if applied else "schema is up to date")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
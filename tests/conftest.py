@@ -0,0 +1,8 @@
+import os
+
+# Настройки без .env: модули src читают settings при импорте
+for name, value in {"DB_NAME": "test", "DB_HOST": "localhost", "DB_USER": "test", "DB_PORT": "5432",
+                    "DB_PASS": "test", "SECRET_AUTH": "test", "API_GRAPHHOPPER": "test"}.items():
+    os.environ.setdefault(name, value)
+
+import src.main  # noqa: E402,F401 — порядок импорта моделей как в приложении
@@ -0,0 +1,28 @@
+import src.assets
+from src.assets import asset_url, lookup_asset, manifest
+
+
+def test_asset_url_hashes_files_inside_static(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static" / "products").mkdir(parents=True)
+    (tmp_path / "static" / "products" / "a.jpg").write_bytes(b"image")
+    monkeypatch.setattr(src.assets, "_manifest", {})
+    # Первый вызов отдает путь как есть и регистрирует файл (вне event loop — сразу)
+    assert asset_url("/static/products/a.jpg") == "/static/products/a.jpg"
+    url = asset_url("/static/products/a.jpg")
+    assert url.startswith("/assets/products/a.") and url.endswith(".jpg")
+    assert lookup_asset(url.removeprefix("/assets/"))[0].endswith("a.jpg")
+
+
+def test_unknown_paths_do_not_grow_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "static").mkdir()
+    monkeypatch.setattr(src.assets, "MISSING_LIMIT", 3)
+    monkeypatch.setattr(src.assets, "_manifest", {})
+    monkeypatch.setattr(src.assets, "_missing", {})
+    for n in range(10):
+        assert asset_url(f"static/missing/{n}.jpg") == f"static/missing/{n}.jpg"
+    assert asset_url("https://cdn.example/x.jpg") == "https://cdn.example/x.jpg"
+    assert asset_url("static/../secret.txt") == "static/../secret.txt"
+    assert manifest() == {}
+    assert list(src.assets._missing) == ["static/missing/8.jpg", "static/missing/9.jpg", "static/../secret.txt"]
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+import src.cache
+from src.cache import MemoryCache, RedisCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(src.cache.time, "monotonic", fake)
+    return fake
+
+
+class FakeRedis:
+    # Подмножество redis.asyncio, которое использует RedisCache; TTL только запоминается
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.calls = []
+
+    async def get(self, key):
+        self.calls.append("get")
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.calls.append("set")
+        self.data[key] = value.encode()
+        self.ttls[key] = ex
+
+    async def mget(self, keys):
+        self.calls.append("mget")
+        return [self.data.get(key) for key in keys]
+
+    async def delete(self, *keys):
+        self.calls.append("delete")
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+        return self
+
+    async def execute(self):
+        self.client.calls.append("pipeline")
+        for key, value, ex in self.commands:
+            self.client.data[key] = value.encode()
+            self.client.ttls[key] = ex
+
+
+def test_memory_cache_expires_after_ttl(clock):
+    cache = MemoryCache(maxsize=10, ttl=5)
+    asyncio.run(cache.set("a", 1))
+    clock.now += 4
+    assert asyncio.run(cache.get("a")) == 1
+    clock.now += 2
+    assert asyncio.run(cache.get("a")) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["size"] == 0
+
+
+def test_memory_cache_evicts_least_recently_used(clock):
+    cache = MemoryCache(maxsize=2, ttl=60)
+
+    async def run():
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.get("a")  # b становится самым старым
+        await cache.set("c", 3)
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(run()) == [1, None, 3]
+    assert cache.evictions == 1
+
+
+def test_memory_cache_get_many_returns_found_keys_only(clock):
+    cache = MemoryCache(maxsize=10, ttl=60)
+
+    async def run():
+        await cache.set_many({1: "one", 2: "two"})
+        await cache.delete(2)
+        return await cache.get_many([1, 2, 3])
+
+    assert asyncio.run(run()) == {1: "one"}
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_redis_cache_round_trips_json_with_prefix_and_ttl():
+    client = FakeRedis()
+    cache = RedisCache(client, ttl=30, prefix="product:")
+
+    async def run():
+        await cache.set(7, {"id": 7, "tags": ["a"]})
+        value = await cache.get(7)
+        await cache.delete(7)
+        return value, await cache.get(7)
+
+    assert asyncio.run(run()) == ({"id": 7, "tags": ["a"]}, None)
+    assert client.ttls == {"product:7": 30}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_redis_cache_batches_many_keys_in_one_call():
+    client = FakeRedis()
+    cache = RedisCache(client, ttl=30, prefix="product:")
+
+    async def run():
+        await cache.set_many({1: {"id": 1}, 2: {"id": 2}})
+        return await cache.get_many([1, 2, 3])
+
+    assert asyncio.run(run()) == {1: {"id": 1}, 2: {"id": 2}}
+    assert client.calls == ["pipeline", "mget"]
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert asyncio.run(cache.get_many([])) == {}
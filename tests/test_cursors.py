@@ -0,0 +1,23 @@
+import pytest
+
+from src.core import Core
+from src.products.utils import encode_cursor, decode_cursor
+
+
+def test_cursor_round_trip():
+    values = ["price_down", 1500, 42]
+    assert decode_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("cursor", ["not base64 at all!", encode_cursor({"a": 1})[:-1], "e30"])
+def test_decode_cursor_rejects_garbage(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_seek_condition_checks_the_sort_method():
+    Core.seek_condition("price_up", encode_cursor(["price_up", 10, 3]))
+    with pytest.raises(ValueError):
+        Core.seek_condition("price_up", encode_cursor(["rating_up", 10, 3]))
+    with pytest.raises(ValueError):
+        Core.seek_condition("price_up", encode_cursor(["price_up", 3]))
@@ -0,0 +1,30 @@
+import pytest
+
+from src.products.utils import product_etag, parse_product_etag, listing_validators, not_modified
+
+
+def test_product_etag_ignores_media_version_for_if_match():
+    etag = product_etag(5, 3, 7)
+    assert etag == '"5-3.7"'
+    assert parse_product_etag(etag) == (5, 3)
+    assert parse_product_etag('W/"5-3.0"') == (5, 3)
+    with pytest.raises(ValueError):
+        parse_product_etag('"not-an-etag"')
+
+
+def test_listing_validators_change_with_card_versions():
+    cards = [{"id": 1, "version": 1, "media_version": 0, "updated_at": "2024-01-01T10:00:00+00:00"},
+             {"id": 2, "version": 4, "media_version": 1, "updated_at": "2024-03-01T10:00:00+00:00"}]
+    etag, last_modified = listing_validators(cards)
+    assert etag.startswith('W/"')
+    assert last_modified == "Fri, 01 Mar 2024 10:00:00 GMT"
+    assert listing_validators([{**cards[0], "media_version": 1}, cards[1]])[0] != etag
+    assert listing_validators(cards[::-1])[0] != etag
+
+
+def test_not_modified_prefers_if_none_match():
+    etag, last_modified = '"1-2.0"', "Fri, 01 Mar 2024 10:00:00 GMT"
+    assert not_modified({"if-none-match": 'W/"1-2.0", "x"'}, etag, last_modified)
+    assert not not_modified({"if-none-match": '"1-1.0"', "if-modified-since": last_modified}, etag, last_modified)
+    assert not_modified({"if-modified-since": last_modified}, etag, last_modified)
+    assert not not_modified({"if-modified-since": "garbage"}, etag, last_modified)
@@ -0,0 +1,76 @@
+import asyncio
+import json
+
+from src.products.utils import parse_import_rows
+
+HEADER = b"name,price,description,tags,main_img,rating_elo,rating_name,username,email,password\n"
+
+
+def parse(data: bytes, fmt: str, chunk: int = 7) -> list:
+    # Маленькие чанки: строки и многобайтные символы режутся на границах
+    async def chunks():
+        for start in range(0, len(data), chunk):
+            yield data[start:start + chunk]
+
+    async def run():
+        return [row async for row in parse_import_rows(chunks(), fmt)]
+
+    return asyncio.run(run())
+
+
+def test_csv_quoted_field_may_contain_newlines():
+    data = HEADER + 'acc,10,"line one\nline, ""two""",cs2 prime,m.jpg,1500,gold,u,e@x,p\n'.encode()
+    [(row_no, row, error)] = parse(data, "csv")
+    assert (row_no, error) == (1, None)
+    assert row.description == 'line one\nline, "two"'
+    assert row.price == 10
+
+
+def test_csv_bad_rows_are_reported_individually():
+    good = "acc,10,ок,t,m.jpg,5,x,u,e,p\r\n".encode()
+    data = (HEADER + good + b"\n" + b"bad,1,\xff\xfe,t,m,5,x,u,e,p\n"
+            + b"big,99999999999,d,t,m,5,x,u,e,p\n" + good + b'tail,"open')
+    rows = parse(data, "csv")
+    assert [row_no for row_no, _, _ in rows] == [1, 2, 3, 4, 5]
+    assert [row is not None for _, row, _ in rows] == [True, False, False, True, False]
+    assert rows[0][1].description == "ок"
+    assert "UTF-8" in rows[1][2]
+    assert "price" in rows[2][2]
+    assert rows[4][2] == "Unterminated quoted field"
+
+
+def test_csv_quote_inside_unquoted_field_is_a_plain_character():
+    data = HEADER + b'acc,10,5" screen,t,m.jpg,5,x,u,e,p\n' + b"next,11,d,t,m.jpg,5,x,u,e,p\n"
+    rows = parse(data, "csv")
+    assert [(row_no, error) for row_no, _, error in rows] == [(1, None), (2, None)]
+    assert rows[0][1].description == '5" screen'
+
+
+def test_csv_unclosed_quote_fails_only_its_own_record():
+    # Четное число кавычек, но четвертое поле открывает кавычку, которую никто не закрывает
+    good = b"ok,1,d,t,m.jpg,5,x,u,e,p\n"
+    data = HEADER + b'acc,10,b"c,"d,m.jpg,5,x,u,e,p\n' + good + good
+    rows = parse(data, "csv")
+    assert [row_no for row_no, _, _ in rows] == [1, 2, 3]
+    assert rows[0][2] == "Unterminated quoted field"
+    assert all(row is not None for _, row, _ in rows[1:])
+
+
+def test_csv_long_unclosed_quote_does_not_swallow_the_stream():
+    good = b"ok,1,d,t,m.jpg,5,x,u,e,p\n"
+    data = HEADER + b'acc,10,"open,t,m.jpg,5,x,u,e,p\n' + good * 150
+    rows = parse(data, "csv")
+    assert len(rows) == 151
+    assert rows[0][2] == "Unterminated quoted field"
+    assert all(row is not None for _, row, _ in rows[1:])
+
+
+def test_ndjson_rows():
+    row = {"name": "acc", "price": 10, "description": "d", "tags": "t", "main_img": "m.jpg", "rating_elo": 5,
+           "rating_name": "x", "username": "u", "email": "e", "password": "p"}
+    overflow = json.dumps({**row, "rating_elo": 2 ** 31}).encode()
+    data = b"\n".join([json.dumps(row).encode(), b"{broken", b"", b"\xff", overflow])
+    rows = parse(data, "ndjson")
+    assert [row_no for row_no, _, _ in rows] == [1, 2, 3, 4]
+    assert rows[0][1].name == "acc" and rows[0][2] is None
+    assert all(parsed is None and error for _, parsed, error in rows[1:])
@@ -0,0 +1,109 @@
+import asyncio
+import math
+
+import numpy as np
+import pytest
+
+from src.products.recommend import RecommendIndex, Recommender
+
+ENTRIES = [(1, ["cs2", "prime"], 100, 1500), (2, ["cs2", "prime"], 110, 1400), (3, ["cs2"], 5000, 100),
+           (4, ["dota2", "ranked"], 300, 3000), (5, ["dota2", "ranked"], 320, 2900), (6, [], 50, 0)]
+
+
+def exact_neighbours(index: RecommendIndex, p_id: int, limit: int) -> list:
+    features = index.dense(np.arange(index.size))
+    sims = features @ features[index.rows[p_id]]
+    order = [row for row in np.argsort(-sims) if index.ids[row] != p_id]
+    return [int(index.ids[row]) for row in order[:limit]]
+
+
+def test_build_finds_the_closest_products():
+    index = RecommendIndex.build(ENTRIES, top_k=3, vocab_size=16, candidates=100)
+    assert index.similar(1, 1)[0][0] == 2
+    assert index.similar(4, 1)[0][0] == 5
+    for p_id, *_ in ENTRIES:
+        neighbours = [n_id for n_id, _ in index.similar(p_id, 3)]
+        assert p_id not in neighbours
+        assert len(set(neighbours)) == len(neighbours)
+
+
+def test_upsert_links_new_products_both_ways():
+    index = RecommendIndex.build(ENTRIES, top_k=2, vocab_size=16, candidates=100)
+    index.upsert([(7, ["dota2", "ranked"], 310, 2950)])
+    assert {n_id for n_id, _ in index.similar(7, 2)} == set(exact_neighbours(index, 7, 2))
+    assert 7 in [n_id for n_id, _ in index.similar(4, 2)]
+    assert 7 in [n_id for n_id, _ in index.similar(5, 2)]
+
+
+def test_upsert_of_an_existing_product_moves_it():
+    index = RecommendIndex.build(ENTRIES, top_k=2, vocab_size=16, candidates=100)
+    index.upsert([(1, ["dota2", "ranked"], 300, 3000)])
+    assert index.size == len(ENTRIES)
+    assert index.similar(1, 1)[0][0] in (4, 5)
+    # Продукты из новых кандидатов (теги dota2) получили текущую близость к 1, а не старую
+    for p_id in (4, 5):
+        for n_id, score in index.similar(p_id, 2):
+            features = index.dense([index.rows[p_id], index.rows[n_id]])
+            assert np.isclose(score, features[0] @ features[1])
+    assert [n_id for n_id, _ in index.similar(4, 2)].count(1) <= 1
+
+
+def test_postings_follow_upserts_and_removes():
+    index = RecommendIndex.build(ENTRIES, top_k=2, vocab_size=16, candidates=100)
+    index.upsert([(1, ["dota2"], 100, 1500), (7, ["cs2"], 90, 1000)])
+    index.remove([2, 4])
+    for tag, col in index.vocab.items():
+        rows = sorted(index.posting(col).tolist())
+        assert rows == sorted(row for row in range(index.size) if col in index.tag_cols[row])
+        for row in rows:
+            k = list(index.tag_cols[row]).index(col)
+            assert index.posting(col)[index.slots[row, k]] == row
+
+
+def test_remove_drops_the_product_everywhere():
+    index = RecommendIndex.build(ENTRIES, top_k=3, vocab_size=16, candidates=100)
+    index.remove([2, 99])
+    assert index.size == len(ENTRIES) - 1
+    assert 2 not in index.rows and index.similar(2, 3) == []
+    for p_id, row in index.rows.items():
+        assert index.ids[row] == p_id  # последняя строка переехала на место удаленной
+        assert 2 not in [n_id for n_id, _ in index.similar(p_id, 3)]
+    scores = [score for _, score in index.similar(1, 3)]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_save_and_load_keep_the_index(tmp_path):
+    index = RecommendIndex.build(ENTRIES, top_k=3, vocab_size=16, candidates=100)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = RecommendIndex.load(path, top_k=3, candidates=100)
+    for p_id, *_ in ENTRIES:
+        assert loaded.similar(p_id, 3) == index.similar(p_id, 3)
+    loaded.upsert([(8, ["cs2", "prime"], 105, 1450)])
+    assert loaded.similar(8, 1)[0][0] in (1, 2)
+
+
+def test_incompatible_index_file_is_rebuilt(tmp_path):
+    path = str(tmp_path / "index.npz")
+    RecommendIndex.build(ENTRIES, top_k=3, vocab_size=16, candidates=100).save(path, mtime=0)
+    with pytest.raises(ValueError):
+        RecommendIndex.load(path, top_k=5, candidates=100)
+    assert math.isinf(Recommender(top_k=5, vocab_size=16, candidates=100).index_age(path))
+    assert Recommender(top_k=3, vocab_size=16, candidates=100).index_age(path) > 0
+    with open(path, "wb") as f:
+        f.write(b"not an index")
+    assert math.isinf(Recommender(top_k=3, vocab_size=16, candidates=100).index_age(path))
+    assert math.isinf(Recommender(top_k=3, vocab_size=16, candidates=100).index_age(str(tmp_path / "missing.npz")))
+
+
+def test_recommender_applies_small_updates():
+    recommender = Recommender(top_k=2, vocab_size=16, candidates=100)
+    recommender.index = RecommendIndex.build(ENTRIES, top_k=2, vocab_size=16, candidates=100)
+
+    async def run():
+        await recommender.upsert([(7, ["dota2", "ranked"], 310, 2950)])
+        await recommender.remove([4])
+
+    asyncio.run(run())
+    assert {n_id for n_id, _ in recommender.similar(7, 2)} == {5}
+    assert [kind for _, kind, _ in recommender.log] == ["upsert", "remove"]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from src.cache import SingleFlight
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "page"
+
+    async def run():
+        return await asyncio.gather(*[flight.do("key", load) for _ in range(5)])
+
+    assert asyncio.run(run()) == ["page"] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert flight._calls == {}
+
+
+def test_single_flight_propagates_errors_and_forgets_the_call():
+    flight = SingleFlight()
+
+    async def fail():
+        raise RuntimeError("db is down")
+
+    async def ok():
+        return 1
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await flight.do("key", fail)
+        return await flight.do("key", ok)
+
+    assert asyncio.run(run()) == 1